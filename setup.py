@@ -47,6 +47,7 @@ SNAPboard requires Django 1.0.''',
     package_data={'snapboard': [
         'media/*/*.*',
         'media/*/*/*.*',
+        'sql/*.sql',
         'templates/*.*',
         'templates/snapboard/*.*',
         'templates/notification/*.*',
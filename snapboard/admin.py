@@ -1,19 +1,143 @@
 from snapboard import models as smodels
+from snapboard import moderation
 from django.contrib import admin
+from django.contrib.admin import actions as admin_actions
+from django.contrib.admin.util import unquote
+from django.contrib.auth.models import User
+from django.utils.translation import ugettext_lazy as _
 
 class CategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("name",)}
 
-class ThreadAdmin(admin.ModelAdmin):
+def moderation_action(name, description):
+    # Admin action running a set-based moderation action on the selection.
+    def action(modeladmin, request, queryset):
+        ids = list(queryset.values_list('pk', flat=True))
+        count = moderation.perform(name, ids)
+        modeladmin.message_user(request, _('%i thread(s) updated.') % count)
+    action.__name__ = 'moderation_%s' % name
+    action.short_description = description
+    return action
+
+def move_action(category):
+    def action(modeladmin, request, queryset):
+        ids = list(queryset.values_list('pk', flat=True))
+        count = moderation.move_threads(ids, category)
+        modeladmin.message_user(request, _('%i thread(s) moved.') % count)
+    action.__name__ = 'move_to_%i' % category.pk
+    action.short_description = _('Move to %s') % category
+    return action
+
+class RollupAdmin(admin.ModelAdmin):
+    """
+    Refreshes the rollups of the categories touched by saves and deletes made
+    in the admin, which bypass the managers keeping them up to date.
+    
+    """
+    category_field = 'category'
+    
+    def get_category_ids(self, queryset):
+        return set(queryset.values_list(self.category_field, flat=True))
+    
+    def get_object_category_ids(self, obj):
+        if obj is None or obj.pk is None:
+            return set()
+        return self.get_category_ids(self.model._default_manager.filter(pk=obj.pk))
+    
+    def refresh_rollups(self, category_ids):
+        category_ids.discard(None)
+        if category_ids:
+            smodels.Category.objects.refresh_rollups(category_ids)
+    
+    def save_model(self, request, obj, form, change):
+        # The object may be moved to another category.
+        category_ids = self.get_object_category_ids(obj)
+        super(RollupAdmin, self).save_model(request, obj, form, change)
+        self.refresh_rollups(category_ids | self.get_object_category_ids(obj))
+    
+    def delete_view(self, request, object_id, extra_context=None):
+        obj = self.get_object(request, unquote(object_id))
+        category_ids = self.get_object_category_ids(obj)
+        response = super(RollupAdmin, self).delete_view(request, object_id, 
+            extra_context)
+        if request.method == 'POST':
+            self.refresh_rollups(category_ids)
+        return response
+
+class ThreadAdmin(RollupAdmin):
     list_display = ('user', 'name', 'category', 'sticky', 'private', 'closed')
     list_filter = ('closed', 'sticky', 'category', 'private',)
     search_fields = ('name',)
     raw_id_fields = ('user', 'category')
+    actions = list(moderation_action(name, description) 
+        for name, (description, func) in sorted(moderation.ACTIONS.items()))
+    
+    def get_actions(self, request):
+        actions = super(ThreadAdmin, self).get_actions(request)
+        # Replaced by the set-based delete action.
+        if 'delete_selected' in actions:
+            del actions['delete_selected']
+        for category in smodels.Category.objects.all():
+            action = move_action(category)
+            actions[action.__name__] = (action, action.__name__, 
+                action.short_description)
+        return actions
 
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(RollupAdmin):
     list_display = ('user', 'date', 'thread', 'ip')
     search_fields = ('text', 'user')
     raw_id_fields = ('thread', 'user',)
+    actions = ['delete_selected', 'ban_ips', 'purge_users', 'purge_ips']
+    category_field = 'thread__category'
+    
+    def delete_selected(self, request, queryset):
+        category_ids = self.get_category_ids(queryset)
+        response = admin_actions.delete_selected(self, request, queryset)
+        # None once confirmed and deleted, the confirmation page otherwise.
+        if response is None:
+            self.refresh_rollups(category_ids)
+        return response
+    delete_selected.short_description = admin_actions.delete_selected.short_description
+    
+    def ban_ips(self, request, queryset):
+        ips = set(queryset.exclude(ip=None).values_list('ip', flat=True))
+        count = 0
+        for ip in ips:
+            ban, created = smodels.IPBan.objects.get_or_create(address=ip, 
+                defaults={'reason': _('Banned from the posts admin.')})
+            count += created
+        self.message_user(request, _('%i IP address(es) banned.') % count)
+    ban_ips.short_description = _('Ban the IP addresses of the selected posts')
+    
+    def purge_users(self, request, queryset):
+        users = User.objects.filter(pk__in=set(queryset.values_list('user', flat=True)))
+        for user in users:
+            report = moderation.purge(user=user)
+            self.message_user(request, _('%(user)s: %(posts)i post(s) and '
+                '%(threads)i thread(s) deleted.') % dict(report, user=user))
+    purge_users.short_description = _('Delete all content by the authors of the selected posts')
+    
+    def purge_ips(self, request, queryset):
+        ips = set(queryset.exclude(ip=None).values_list('ip', flat=True))
+        for ip in ips:
+            report = moderation.purge(ip=ip)
+            self.message_user(request, _('%(ip)s: %(posts)i post(s) and '
+                '%(threads)i thread(s) deleted.') % dict(report, ip=ip))
+    purge_ips.short_description = _('Delete all content from the IP addresses of the selected posts')
+
+class IPBanAdmin(admin.ModelAdmin):
+    list_display = ('address', 'reason', 'date')
+    search_fields = ('address', 'reason')
+
+class UserBanAdmin(admin.ModelAdmin):
+    list_display = ('user', 'reason', 'date')
+    raw_id_fields = ('user',)
+
+class APITokenAdmin(admin.ModelAdmin):
+    list_display = ('user', 'date', 'revoked')
+    list_filter = ('revoked',)
+    raw_id_fields = ('user',)
+    readonly_fields = ('digest',)
 
 
 admin.site.register(smodels.Category, CategoryAdmin)
@@ -21,3 +145,6 @@ admin.site.register(smodels.Post, PostAdmin)
 admin.site.register(smodels.Thread, ThreadAdmin)
 #admin.site.register(smodels.WatchList, WatchListAdmin)
 admin.site.register(smodels.UserSettings)
+admin.site.register(smodels.APIToken, APITokenAdmin)
+admin.site.register(smodels.IPBan, IPBanAdmin)
+admin.site.register(smodels.UserBan, UserBanAdmin)
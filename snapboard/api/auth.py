@@ -1,6 +1,10 @@
 from django.contrib.auth import authenticate
+from django.http import HttpResponse
 from piston.authentication import HttpBasicAuthentication
 
+from snapboard.bans import get_index
+from snapboard.models import APIToken
+
 
 def staff_authenticate(username, password):
     """
@@ -8,10 +12,41 @@ def staff_authenticate(username, password):
 
     """
     user = authenticate(username=username, password=password)
-    return (user is not None and user.is_staff and user) or None
+    # Resources authenticate after the ban middleware ran.
+    if user is None or not user.is_staff or get_index().is_user_banned(user):
+        return None
+    return user
 
 
 class StaffHttpBasicAuthentication(HttpBasicAuthentication):
     def __init__(self, auth_func=staff_authenticate, realm='API'):
         super(StaffHttpBasicAuthentication, self).__init__(auth_func=auth_func, 
-            realm=realm)
\ No newline at end of file
+            realm=realm)
+
+
+class StaffTokenAuthentication(object):
+    """
+    Authenticates staff users with an API token sent as 
+    ``Authorization: Token <key>``. Unlike HTTP basic authentication, no 
+    password hash is computed per request.
+    
+    """
+    def __init__(self, realm='API'):
+        self.realm = realm
+    
+    def is_authenticated(self, request):
+        auth = request.META.get('HTTP_AUTHORIZATION', '').split(None, 1)
+        if len(auth) != 2 or auth[0].lower() != 'token':
+            return False
+        
+        user = APIToken.objects.get_user(auth[1].strip())
+        if user is None or get_index().is_user_banned(user):
+            return False
+        request.user = user
+        return True
+    
+    def challenge(self):
+        resp = HttpResponse("Authorization Required")
+        resp['WWW-Authenticate'] = 'Token realm="%s"' % self.realm
+        resp.status_code = 401
+        return resp
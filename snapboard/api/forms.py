@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.models import User
 
 from snapboard.models import Thread, Post
+from snapboard.routers import pin_to_primary
 from snapboard.utils import RequestModelForm
 
 
@@ -18,6 +19,7 @@ class ThreadForm(RequestModelForm):
         fields = ("user", "category", "name", "private", "text", "subscribers",)
     
     def save(self):
+        pin_to_primary()
         thread_data = self.cleaned_data.copy()
         thread_data.pop("text")
         subscribers =  thread_data.pop("subscribers")
@@ -3,10 +3,15 @@ from django.conf.urls.defaults import *
 from piston.resource import Resource
 
 from snapboard.api.handlers import ThreadHandler
-from snapboard.api.auth import StaffHttpBasicAuthentication
+from snapboard.api.auth import StaffHttpBasicAuthentication, \
+    StaffTokenAuthentication
 
 
-auth = StaffHttpBasicAuthentication(realm="Snapboard")
+# Tokens are tried first; basic auth is kept for existing clients.
+auth = (
+    StaffTokenAuthentication(realm="Snapboard"),
+    StaffHttpBasicAuthentication(realm="Snapboard"),
+)
 thread = Resource(ThreadHandler, authentication=auth)
 
 urlpatterns = patterns('',
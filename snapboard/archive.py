@@ -0,0 +1,171 @@
+"""
+Archival of cold threads.
+
+Threads without activity for SB_ARCHIVE_AFTER_DAYS days are moved with 
+their posts to the archive tables, in the SB_ARCHIVE_DATABASE database if 
+set, which keeps the thread and post tables small. Archived threads are 
+still displayed read-only by the thread view, and are restored to the main
+tables when a user replies.
+
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import models, router, transaction
+
+from snapboard.models import Category, Thread, Post, UserSettings, \
+    ArchivedThread, ArchivedPost, invalidate_pages, ARCHIVE_DATABASE
+from snapboard.moderation import delete_thread_rows, delete_in, get_slugs, \
+    get_category_ids, get_author_ids
+from snapboard.routers import is_pinned, pin_to_primary, unpin
+
+
+ARCHIVE_AFTER_DAYS = getattr(settings, 'SB_ARCHIVE_AFTER_DAYS', 365)
+
+THREAD_FIELDS = ('id', 'user_id', 'category_id', 'name', 'slug', 'private',
+    'closed', 'sticky', 'date', 'views')
+POST_FIELDS = ('id', 'thread_id', 'user_id', 'text', 'date', 'ip')
+
+
+def get_archive_db():
+    return ARCHIVE_DATABASE or router.db_for_write(ArchivedThread)
+
+def is_slug_archived(slug):
+    return ArchivedThread.objects.using(get_archive_db()).filter(slug=slug).exists()
+
+def get_cold_threads(days=ARCHIVE_AFTER_DAYS):
+    cutoff = datetime.now() - timedelta(days=days)
+    return Thread.objects.filter(date__lt=cutoff, sticky=False)
+
+def copy_threads(thread_ids, db):
+    # Copies the threads, their posts and subscribers to the archive.
+    subscriptions = Thread.subscribers.through.objects \
+        .filter(thread__in=thread_ids).values_list('thread', 'user')
+    subscribers = {}
+    for thread_id, user_id in subscriptions:
+        subscribers.setdefault(thread_id, []).append(str(user_id))
+    
+    # Copying again after an interrupted run must not fail.
+    delete_in(ArchivedPost, 'thread_id', thread_ids, using=db)
+    delete_in(ArchivedThread, 'id', thread_ids, using=db)
+    
+    for values in Thread.objects.filter(pk__in=thread_ids).values(*THREAD_FIELDS):
+        values['subscriber_ids'] = ','.join(subscribers.get(values['id'], []))
+        ArchivedThread(**values).save(using=db, force_insert=True)
+    posts = Post.objects.filter(thread__in=thread_ids).values(*POST_FIELDS)
+    for values in posts.iterator():
+        ArchivedPost(**values).save(using=db, force_insert=True)
+
+def archive_threads(thread_ids):
+    '''
+    Moves the threads and their posts to the archive. Returns the number of
+    threads archived.
+    
+    '''
+    thread_ids = list(thread_ids)
+    if not thread_ids:
+        return 0
+    db = get_archive_db()
+    slugs = get_slugs(thread_ids)
+    category_ids = get_category_ids(thread_ids)
+    transaction.commit_on_success(using=db)(copy_threads)(thread_ids, db)
+    
+    # The copies are committed, the originals can go.
+    count = delete_thread_rows(thread_ids)
+    Category.objects.refresh_rollups(category_ids)
+    invalidate_pages(slugs)
+    return count
+
+def archive(days=ARCHIVE_AFTER_DAYS, batch_size=100):
+    '''
+    Archives the threads inactive for days, batch_size threads at a time, and
+    returns the number of threads archived.
+    
+    '''
+    total = 0
+    while True:
+        batch = list(get_cold_threads(days).order_by('pk')
+            .values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return total
+        total += archive_threads(batch)
+
+def get_archived_thread(cslug, tslug):
+    '''
+    Returns the archived thread at the given slugs, or None.
+    
+    '''
+    try:
+        thread = ArchivedThread.objects.using(get_archive_db()).get(slug=tslug)
+    except ArchivedThread.DoesNotExist:
+        return None
+    if thread.category.slug != cslug:
+        return None
+    # Restored, the archived copy is left over from an interrupted restore.
+    if Thread.objects.filter(pk=thread.pk).exists():
+        return None
+    return thread
+
+def copy_back(archived):
+    # Copies the thread, its posts and subscribers back to the main tables.
+    values = dict((name, getattr(archived, name)) for name in THREAD_FIELDS)
+    thread = Thread(**values)
+    thread.save(force_insert=True)
+    if archived.subscriber_ids:
+        thread.subscribers.add(*[int(pk) for pk in archived.subscriber_ids.split(',')])
+    
+    for post in archived.get_posts().iterator():
+        values = dict((name, getattr(post, name)) for name in POST_FIELDS)
+        # Skip Post.save(), the pages are invalidated once afterwards.
+        models.Model.save(Post(**values), force_insert=True)
+    return thread
+
+def copy_back_with_reply(archived, user, text, ip):
+    thread = copy_back(archived)
+    post = Post(thread=thread, user=user, text=text, ip=ip, date=datetime.now())
+    models.Model.save(post, force_insert=True)
+    thread.date = post.date
+    Thread.objects.filter(pk=thread.pk).update(date=post.date)
+    return post
+
+def delete_archived(archived):
+    db = archived._state.db
+    delete_in(ArchivedPost, 'thread_id', [archived.id], using=db)
+    delete_in(ArchivedThread, 'id', [archived.id], using=db)
+
+def refresh_restored(thread):
+    Category.objects.refresh_rollups([thread.category_id])
+    UserSettings.objects.refresh_stats(get_author_ids([thread.pk]))
+    invalidate_pages([(thread.category.slug, thread.slug)])
+
+def restore_thread(archived):
+    '''
+    Moves an archived thread and its posts back to the main tables and 
+    returns the restored Thread. Reads are left pinned to the primary only
+    if they already were, as they are after a write in a request.
+    
+    '''
+    pinned = is_pinned()
+    pin_to_primary()
+    try:
+        thread = transaction.commit_on_success(copy_back)(archived)
+        # The copy is committed, the archived thread can go.
+        delete_archived(archived)
+        refresh_restored(thread)
+    finally:
+        if not pinned:
+            unpin()
+    return thread
+
+def reply(archived, user, text, ip=None):
+    '''
+    Restores an archived thread with a new post by user, in one transaction,
+    and returns the post.
+    
+    '''
+    pin_to_primary()
+    post = transaction.commit_on_success(copy_back_with_reply)(archived, user,
+        text, ip)
+    delete_archived(archived)
+    refresh_restored(post.thread)
+    return post
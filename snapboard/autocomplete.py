@@ -0,0 +1,291 @@
+"""
+In-process prefix indexes of thread titles and usernames, for type-ahead.
+
+Each word of a title is a key. Keys are kept in a sorted list next to an
+array of thread ids, so a lookup is a bisection then a short scan, with no
+database or cache access. The indexes are built on the first lookup of a
+process and rebuilt every SB_AUTOCOMPLETE_REBUILD seconds.
+
+Saves of threads and users are applied right away in the saving process,
+and logged to a CacheQueue that the other processes replay at most once
+every SB_AUTOCOMPLETE_SYNC seconds. If entries of the log were lost, the
+index is rebuilt.
+
+"""
+import bisect
+import re
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+
+from snapboard import stats
+from snapboard.models import Category, Thread
+from snapboard.utils import CacheQueue
+
+
+REBUILD_INTERVAL = getattr(settings, 'SB_AUTOCOMPLETE_REBUILD', 3600)
+SYNC_INTERVAL = getattr(settings, 'SB_AUTOCOMPLETE_SYNC', 1)
+RESULTS = getattr(settings, 'SB_AUTOCOMPLETE_RESULTS', 10)
+# Index entries examined per lookup at most.
+SCAN_LIMIT = 2000
+
+changes = CacheQueue('autocomplete')
+
+re_word = re.compile(r'\w+', re.U)
+
+
+def tokenize(text):
+    return re_word.findall(text.lower())
+
+
+class PrefixIndex(object):
+    """
+    Maps words to ids. Each id has an item, a tuple whose first element is
+    the indexed text.
+
+    """
+    def __init__(self):
+        self.keys = []
+        self.ids = array('l')
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def load(self, rows):
+        '''
+        Replaces the content of the index with rows, (id, item) pairs.
+
+        '''
+        entries = []
+        items = {}
+        for pk, item in rows:
+            items[pk] = item
+            for word in set(tokenize(item[0])):
+                entries.append((word, pk))
+        entries.sort()
+        keys = [word for word, pk in entries]
+        ids = array('l', [pk for word, pk in entries])
+        self._lock.acquire()
+        try:
+            self.keys, self.ids, self.items = keys, ids, items
+        finally:
+            self._lock.release()
+
+    def add(self, pk, item):
+        self._lock.acquire()
+        try:
+            self._remove(pk)
+            self.items[pk] = item
+            for word in set(tokenize(item[0])):
+                i = bisect.bisect_right(self.keys, word)
+                self.keys.insert(i, word)
+                self.ids.insert(i, pk)
+        finally:
+            self._lock.release()
+
+    def remove(self, pk):
+        self._lock.acquire()
+        try:
+            self._remove(pk)
+        finally:
+            self._lock.release()
+
+    def _remove(self, pk):
+        item = self.items.pop(pk, None)
+        if item is None:
+            return
+        for word in set(tokenize(item[0])):
+            i = bisect.bisect_left(self.keys, word)
+            while i < len(self.keys) and self.keys[i] == word:
+                if self.ids[i] == pk:
+                    del self.keys[i]
+                    del self.ids[i]
+                    break
+                i += 1
+
+    def search(self, query, limit=RESULTS, test=None):
+        '''
+        Returns up to limit (id, item) pairs whose text has words starting
+        with every word of query, and for which test(item), if given, is
+        true.
+
+        '''
+        terms = tokenize(query)
+        if not terms:
+            return []
+        # Scan the range of the longest term, the narrowest.
+        first = max(terms, key=len)
+        others = [term for term in terms if term != first]
+
+        results = []
+        seen = set()
+        self._lock.acquire()
+        try:
+            i = bisect.bisect_left(self.keys, first)
+            end = min(len(self.keys), i + SCAN_LIMIT)
+            while i < end and len(results) < limit:
+                if not self.keys[i].startswith(first):
+                    break
+                pk = self.ids[i]
+                i += 1
+                if pk in seen:
+                    continue
+                seen.add(pk)
+                item = self.items[pk]
+                if others:
+                    words = tokenize(item[0])
+                    if [term for term in others if not
+                            [word for word in words if word.startswith(term)]]:
+                        continue
+                if test is None or test(item):
+                    results.append((pk, item))
+        finally:
+            self._lock.release()
+        return results
+
+
+def get_thread_rows(qs):
+    for row in qs.values_list('pk', 'name', 'private', 'user', 'category',
+            'slug').iterator():
+        yield row[0], row[1:]
+
+def get_user_rows(qs):
+    for pk, username in qs.values_list('pk', 'username').iterator():
+        yield pk, (username,)
+
+
+class Indexes(object):
+    """
+    The thread and user indexes of the process, kept in sync.
+
+    """
+    def __init__(self):
+        self.threads = PrefixIndex()
+        self.users = PrefixIndex()
+        self.category_slugs = {}
+        self.built = None
+        self.synced = 0
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def build(self):
+        # Take the log position first, changes made while loading are
+        # replayed afterwards.
+        version = changes.get_tail()
+        self.threads.load(get_thread_rows(Thread.objects.all()))
+        self.users.load(get_user_rows(User.objects.filter(is_active=True)))
+        self.category_slugs = dict(Category.objects.values_list('pk', 'slug'))
+        self.version = version
+        self.built = self.synced = time.time()
+        stats.incr('autocomplete.rebuild')
+
+    def ensure_fresh(self):
+        now = time.time()
+        if self.built is not None and now - self.synced < SYNC_INTERVAL \
+                and now - self.built < REBUILD_INTERVAL:
+            return
+        # One thread updates, the others use the index as it is.
+        if not self._lock.acquire(self.built is None):
+            return
+        try:
+            if self.built is None or now - self.built >= REBUILD_INTERVAL:
+                self.build()
+            else:
+                self.sync()
+        finally:
+            self._lock.release()
+
+    def sync(self):
+        while True:
+            version, items = changes.read(self.version, 1000)
+            if items is None:
+                return self.build()
+            self.version = version
+            if not items:
+                break
+            self.apply(items)
+        self.synced = time.time()
+
+    def apply(self, items):
+        '''
+        Reloads the threads and users of items, ('thread' or 'user', id)
+        pairs, from the database.
+
+        '''
+        for kind, index, qs, get_rows in (
+                ('thread', self.threads, Thread.objects.all(), get_thread_rows),
+                ('user', self.users, User.objects.filter(is_active=True),
+                    get_user_rows)):
+            ids = set([pk for k, pk in items if k == kind])
+            if not ids:
+                continue
+            for pk, item in get_rows(qs.filter(pk__in=ids)):
+                index.add(pk, item)
+                ids.discard(pk)
+            for pk in ids:
+                index.remove(pk)
+
+    def changed(self, kind, ids):
+        '''
+        Records that threads or users were created, changed or deleted.
+
+        '''
+        items = [(kind, pk) for pk in ids]
+        for item in items:
+            changes.put(item)
+        if self.built is not None:
+            self.apply(items)
+    
+    def get_category_slug(self, pk):
+        slug = self.category_slugs.get(pk)
+        if slug is None:
+            slug = self.category_slugs[pk] = Category.objects.get(pk=pk).slug
+        return slug
+
+indexes = Indexes()
+
+
+def search_threads(query, user, limit=RESULTS):
+    '''
+    Returns the titles and URLs of the threads matching query that user can
+    see.
+
+    '''
+    indexes.ensure_fresh()
+    test = None
+    if not user.is_staff:
+        user_id = user.is_authenticated() and user.pk or None
+        test = lambda item: not item[1] or item[2] == user_id
+    return [{
+        'name': name,
+        'url': reverse('sb_thread', args=(indexes.get_category_slug(category_id),
+            slug)),
+    } for pk, (name, private, user_id, category_id, slug)
+        in indexes.threads.search(query, limit, test)]
+
+def search_users(query, limit=RESULTS):
+    indexes.ensure_fresh()
+    return [{'name': item[0]} for pk, item in indexes.users.search(query, limit)]
+
+
+def record_change(sender, instance, **kwargs):
+    '''
+    Signal handler updating the indexes after a thread or user was saved or 
+    deleted.
+    
+    '''
+    if sender is Thread:
+        index, kind = indexes.threads, 'thread'
+        item = (instance.name, instance.private, instance.user_id, 
+            instance.category_id, instance.slug)
+    else:
+        index, kind = indexes.users, 'user'
+        item = (instance.username,)
+    # Skip saves that change nothing indexed, threads are saved often.
+    if 'created' in kwargs and getattr(instance, 'is_active', True) and \
+            index.items.get(instance.pk) == item:
+        return
+    indexes.changed(kind, [instance.pk])
@@ -0,0 +1,147 @@
+"""
+In-process index of IP and user bans.
+
+Bans are compiled into sorted, merged address intervals so that a lookup is
+a binary search, and into a set of user ids. Every process keeps its own 
+index and rebuilds it when the ban generation stored in the cache changes; 
+the generation is bumped whenever a ban is saved or deleted.
+
+"""
+import socket
+import struct
+import threading
+from bisect import bisect_right
+
+from snapboard.localcache import tiered
+from snapboard.utils import new_cache_prefix
+
+
+GENERATION_KEY = 'sb.bans.generation'
+
+
+def parse_network(address):
+    '''
+    Returns (version, first, last) for an address or a CIDR network, with 
+    the addresses as integers. Raises ValueError for invalid input.
+    
+    '''
+    address = address.strip()
+    if '/' in address:
+        address, bits = address.split('/', 1)
+    else:
+        bits = None
+    
+    try:
+        if ':' in address:
+            version, size = 6, 128
+            high, low = struct.unpack('!QQ', socket.inet_pton(socket.AF_INET6, address))
+            value = (high << 64) | low
+        else:
+            version, size = 4, 32
+            if address.count('.') != 3:
+                raise ValueError
+            value = struct.unpack('!I', socket.inet_aton(address))[0]
+    except (socket.error, struct.error, ValueError):
+        raise ValueError('Invalid IP address: %s' % address)
+    
+    if bits is None:
+        return version, value, value
+    try:
+        bits = int(bits)
+    except ValueError:
+        raise ValueError('Invalid network size: %s' % bits)
+    if not 0 <= bits <= size:
+        raise ValueError('Invalid network size: %s' % bits)
+    host_mask = (1 << (size - bits)) - 1
+    first = value & ~host_mask
+    return version, first, first | host_mask
+
+
+class IntervalIndex(object):
+    """
+    Sorted, non-overlapping intervals with O(log n) membership tests.
+    
+    """
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        for first, last in sorted(intervals):
+            if self.ends and first <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], last)
+            else:
+                self.starts.append(first)
+                self.ends.append(last)
+    
+    def __contains__(self, value):
+        i = bisect_right(self.starts, value) - 1
+        return i >= 0 and value <= self.ends[i]
+    
+    def __len__(self):
+        return len(self.starts)
+
+
+class BanIndex(object):
+    def __init__(self, networks=(), user_ids=(), generation=None):
+        intervals = {4: [], 6: []}
+        for address in networks:
+            try:
+                version, first, last = parse_network(address)
+            except ValueError:
+                continue
+            intervals[version].append((first, last))
+        self.networks = dict((v, IntervalIndex(i)) for v, i in intervals.items())
+        self.user_ids = frozenset(user_ids)
+        self.generation = generation
+    
+    def is_ip_banned(self, address):
+        if not address:
+            return False
+        try:
+            version, value, _ = parse_network(address)
+        except ValueError:
+            return False
+        return value in self.networks[version]
+    
+    def is_user_banned(self, user):
+        return user.is_authenticated() and user.id in self.user_ids
+
+
+_index = [BanIndex()]
+_lock = threading.Lock()
+
+def get_generation():
+    generation = tiered.get(GENERATION_KEY)
+    if generation is None:
+        # Lost from the cache: start a new generation, everyone rebuilds.
+        tiered.shared.add(GENERATION_KEY, new_cache_prefix())
+        generation = tiered.shared.get(GENERATION_KEY)
+        tiered.local.set(GENERATION_KEY, generation)
+    return generation
+
+def bump_generation(*args, **kwargs):
+    tiered.set(GENERATION_KEY, new_cache_prefix())
+
+def get_index():
+    '''
+    Returns this process' ban index, rebuilt if the bans have changed.
+    
+    '''
+    from snapboard.models import IPBan, UserBan
+    
+    generation = get_generation()
+    index = _index[0]
+    if index.generation == generation:
+        return index
+    
+    _lock.acquire()
+    try:
+        index = _index[0]
+        if index.generation != generation:
+            index = BanIndex(
+                IPBan.objects.values_list('address', flat=True).iterator(),
+                UserBan.objects.values_list('user', flat=True).iterator(),
+                generation)
+            _index[0] = index
+    finally:
+        _lock.release()
+    return index
@@ -0,0 +1,191 @@
+"""
+Static asset bundles.
+
+The snapboard_bundle command concatenates the files of each bundle,
+minifies them, and writes them to SB_BUNDLE_ROOT under a name containing
+the hash of their content, next to a gzipped copy and a manifest.json
+mapping bundle names to file names. As a new build changes the names, the
+bundles can be served with a far-future Cache-Control header.
+
+The {% sb_bundle %} tag links to the built bundle, or to the individual
+files when the bundle hasn't been built or SB_USE_BUNDLES is False.
+
+"""
+import gzip
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.utils import simplejson
+from django.utils.hashcompat import md5_constructor
+
+from snapboard.models import MEDIA_PREFIX
+
+try:
+    from jsmin import jsmin
+except ImportError:
+    jsmin = None
+
+
+MEDIA_ROOT = os.path.join(os.path.dirname(__file__), 'media')
+BUNDLE_ROOT = getattr(settings, 'SB_BUNDLE_ROOT',
+    os.path.join(MEDIA_ROOT, 'bundles'))
+# URL of BUNDLE_ROOT, relative to SB_MEDIA_PREFIX unless absolute.
+BUNDLE_URL = getattr(settings, 'SB_BUNDLE_URL', 'bundles')
+USE_BUNDLES = getattr(settings, 'SB_USE_BUNDLES', not settings.DEBUG)
+
+# Bundle name -> files relative to MEDIA_ROOT, in order.
+BUNDLES = {
+    'snapboard.js': (
+        'js/yui/yahoo-min.js',
+        'js/yui/dom-min.js',
+        'js/yui/event-min.js',
+        'js/yui/connection-min.js',
+        'js/yui/autocomplete-min.js',
+        'js/thread.js',
+        'js/group.js',
+    ),
+    'snapboard.css': (
+        'css/yui/reset-fonts-grids.css',
+        'css/center.css',
+        'css/form.css',
+        'css/snapboard.css',
+        'css/nav.css',
+        'css/post.css',
+    ),
+}
+BUNDLES.update(getattr(settings, 'SB_BUNDLES', {}))
+
+MANIFEST = 'manifest.json'
+
+re_css_comment = re.compile(r'/\*.*?\*/', re.S)
+# Spaces before a colon may be part of a selector, "div :first-child".
+re_css_space = re.compile(r'\s*([{};,>])\s*|(:)\s+|\s+')
+re_css_url = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def get_url(path):
+    if BUNDLE_URL.startswith('/') or '://' in BUNDLE_URL:
+        base = BUNDLE_URL
+    else:
+        base = '%s/%s' % (MEDIA_PREFIX.rstrip('/'), BUNDLE_URL)
+    return '%s/%s' % (base.rstrip('/'), path)
+
+def get_media_url(path):
+    return '%s/%s' % (MEDIA_PREFIX.rstrip('/'), path)
+
+def minify_css(css):
+    css = re_css_comment.sub('', css)
+    return re_css_space.sub(lambda m: m.group(1) or m.group(2) or ' ', css).strip()
+
+def rebase_css_urls(css, path, bundle_dir):
+    '''
+    Rewrites the relative url()s of the CSS file at path, relative to
+    MEDIA_ROOT, so they resolve from bundle_dir, relative to MEDIA_ROOT too.
+
+    '''
+    def rebase(match):
+        url = match.group(2)
+        if url.startswith('/') or url.startswith('data:') or '://' in url:
+            return match.group(0)
+        url = posixpath.normpath(posixpath.join(posixpath.dirname(path), url))
+        return 'url(%s)' % posixpath.relpath(url, bundle_dir)
+    return re_css_url.sub(rebase, css)
+
+def build_bundle(name, paths, media_root=MEDIA_ROOT, bundle_root=BUNDLE_ROOT):
+    '''
+    Builds the bundle name from paths and returns the name of the file
+    written to bundle_root.
+
+    '''
+    bundle_dir = posixpath.relpath(bundle_root.replace(os.sep, '/'),
+        media_root.replace(os.sep, '/'))
+    if bundle_dir.startswith('..'):
+        # Outside the media, assume it's served one level below the prefix
+        # like the default.
+        bundle_dir = 'bundles'
+    parts = []
+    for path in paths:
+        f = open(os.path.join(media_root, *path.split('/')))
+        try:
+            content = f.read()
+        finally:
+            f.close()
+        if name.endswith('.css'):
+            content = minify_css(rebase_css_urls(content, path, bundle_dir))
+        elif name.endswith('.js') and jsmin is not None \
+                and not path.endswith('-min.js'):
+            content = jsmin(content)
+        parts.append(content)
+    # Separate with ; so scripts without a trailing one don't run together.
+    content = (name.endswith('.js') and ';\n' or '\n').join(parts)
+
+    base, ext = os.path.splitext(name)
+    filename = '%s.%s%s' % (base, md5_constructor(content).hexdigest()[:12], ext)
+    path = os.path.join(bundle_root, filename)
+    f = open(path, 'wb')
+    try:
+        f.write(content)
+    finally:
+        f.close()
+    f = gzip.open(path + '.gz', 'wb', 9)
+    try:
+        f.write(content)
+    finally:
+        f.close()
+    return filename
+
+def build(bundles=None, media_root=MEDIA_ROOT, bundle_root=BUNDLE_ROOT):
+    '''
+    Builds the bundles and writes the manifest. Returns the manifest, a dict
+    of bundle name -> file name.
+
+    '''
+    if bundles is None:
+        bundles = BUNDLES
+    if not os.path.isdir(bundle_root):
+        os.makedirs(bundle_root)
+    manifest = {}
+    for name, paths in bundles.items():
+        manifest[name] = build_bundle(name, paths, media_root, bundle_root)
+    f = open(os.path.join(bundle_root, MANIFEST), 'w')
+    try:
+        f.write(simplejson.dumps(manifest, indent=2))
+    finally:
+        f.close()
+    return manifest
+
+
+# (mtime, manifest) of the last manifest read.
+_manifest = (None, {})
+
+def get_manifest():
+    '''
+    Returns the manifest, read again whenever the file changes.
+
+    '''
+    global _manifest
+    path = os.path.join(BUNDLE_ROOT, MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return {}
+    if mtime != _manifest[0]:
+        f = open(path)
+        try:
+            _manifest = (mtime, simplejson.loads(f.read()))
+        finally:
+            f.close()
+    return _manifest[1]
+
+def get_urls(name):
+    '''
+    Returns the URLs to link to for the bundle name.
+
+    '''
+    if USE_BUNDLES:
+        filename = get_manifest().get(name)
+        if filename is not None:
+            return [get_url(filename)]
+    return [get_media_url(path) for path in BUNDLES[name]]
@@ -1,32 +1,38 @@
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save
 from django.dispatch import Signal
 
 
 class SignalFieldMixin(object):
     """
-    If the model instance contains this field is while this field is dirty,
-    fires a signal providing the state of the model when it was first made.
-    
+    Fires fields_updated when a model instance is saved with a new value of
+    this field, providing the value it was loaded or last saved with.
+
+    The values are kept in the instance's _sb_initial dict: _state holds
+    Django's ModelState.
+
     """
-    def value_from_object(self, obj):
-        if not hasattr(obj, "_state"):
-            obj._state = {}
-        obj._state[self.name] = obj.__dict__.get(self.name)
-        return super(SignalFieldMixin, self).value_from_object(obj)
-    
     def contribute_to_class(self, cls, name):
         super(SignalFieldMixin, self).contribute_to_class(cls, name)
+        post_init.connect(self.remember, sender=cls)
         post_save.connect(self.updated, sender=cls)
-        
-    def updated(self, instance, force=False, *args, **kwargs):
-        if hasattr(instance, "_state"):
-            fields_updated.send(sender=instance, state=instance._state)
-            # Prevent multiple signals, reset state.
-            del instance._state
+
+    def remember(self, instance, **kwargs):
+        instance.__dict__.setdefault('_sb_initial', {})[self.attname] = \
+            instance.__dict__.get(self.attname)
+
+    def updated(self, instance, created=False, **kwargs):
+        initial = instance.__dict__.setdefault('_sb_initial', {})
+        old = initial.get(self.attname)
+        new = getattr(instance, self.attname)
+        # Reset first, receivers may save the instance again.
+        initial[self.attname] = new
+        if not created and old != new:
+            fields_updated.send(sender=type(instance), instance=instance,
+                state={self.name: old})
 
 
 class SignalSlugField(SignalFieldMixin, models.SlugField):
     pass
 
-fields_updated = Signal(providing_args=["state"])
\ No newline at end of file
+fields_updated = Signal(providing_args=["instance", "state"])
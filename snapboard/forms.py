@@ -4,6 +4,7 @@ from django import forms
 from django.utils.translation import ugettext_lazy as _
 
 from snapboard.models import Category, Thread, Post, UserSettings
+from snapboard.routers import pin_to_primary
 from snapboard.utils import RequestForm, RequestModelForm
 
 
@@ -21,6 +22,7 @@ class PostForm(RequestModelForm):
     
     def save(self, thread=None):
         data = self.cleaned_data
+        pin_to_primary()
         ip = self.request.META.get('REMOTE_ADDR')
         # TODO: Make this less stupid.
 
@@ -52,6 +54,7 @@ class ThreadForm(RequestForm):
     def save(self):
         data = self.cleaned_data
         user = self.request.user
+        pin_to_primary()
         category = self.category or data['category']
         
         thread = Thread.objects.create_thread(**{
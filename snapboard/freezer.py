@@ -0,0 +1,171 @@
+"""
+Static copies of closed threads.
+
+Closed threads only change through moderation. With SB_FREEZE_ROOT set,
+the snapboard_freeze command renders each page of the closed public
+threads as an anonymous user and writes it, next to a gzipped copy, to
+
+    SB_FREEZE_ROOT/<thread URL path>/<page>.html
+
+The thread view serves these files to anonymous users without querying the
+database or rendering templates, and a front-end server may serve them
+itself to requests without a session cookie.
+
+invalidate_pages() removes the files of the threads it is given right away
+and queues the threads, so moderation actions and post edits thaw a thread
+and the command freezes it again if it is still closed and public.
+
+"""
+import gzip
+import os
+import re
+import shutil
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse
+from django.test.client import Client
+
+from snapboard import stats
+from snapboard.models import Thread
+from snapboard.utils import CacheQueue, re_accepts_gzip
+
+
+FREEZE_ROOT = getattr(settings, 'SB_FREEZE_ROOT', None)
+
+# Set in the environ of the requests rendering the pages, which aren't views.
+FREEZING = 'snapboard.freezing'
+
+queue = CacheQueue('freeze')
+
+re_page = re.compile(r'^\d+$')
+
+
+def get_dir(cslug, tslug):
+    return os.path.join(FREEZE_ROOT,
+        reverse('sb_thread', args=(cslug, tslug)).strip('/'))
+
+def get_path(cslug, tslug, page=1):
+    return os.path.join(get_dir(cslug, tslug), '%i.html' % page)
+
+def enqueue(slugs):
+    for cslug, tslug in slugs:
+        if tslug is not None:
+            queue.put((cslug, tslug))
+
+def thaw(slugs):
+    '''
+    Removes the frozen pages of the threads given as (category slug, thread
+    slug) pairs.
+
+    '''
+    for cslug, tslug in slugs:
+        if tslug is None:
+            continue
+        path = get_dir(cslug, tslug)
+        if os.path.isdir(path):
+            shutil.rmtree(path, True)
+            stats.incr('freeze.thawed')
+
+def write(path, content):
+    # Replaces the files at once, they may be being served.
+    f = open(path + '.tmp', 'wb')
+    try:
+        f.write(content)
+    finally:
+        f.close()
+    f = gzip.open(path + '.gz.tmp', 'wb', 9)
+    try:
+        f.write(content)
+    finally:
+        f.close()
+    os.rename(path + '.gz.tmp', path + '.gz')
+    os.rename(path + '.tmp', path)
+
+def freeze_thread(thread, client=None):
+    '''
+    Renders the pages of thread as an anonymous user and writes them.
+    Returns the number of pages written.
+
+    '''
+    if client is None:
+        client = Client()
+    cslug, tslug = thread.category.slug, thread.slug
+    # The thread view would serve the old files.
+    thaw([(cslug, tslug)])
+    if not os.path.isdir(get_dir(cslug, tslug)):
+        os.makedirs(get_dir(cslug, tslug))
+
+    url = thread.get_url()
+    count = 0
+    for page in range(1, thread.get_page_count() + 1):
+        response = client.get(url, page > 1 and {'page': page} or {}, 
+            **{FREEZING: True})
+        if response.status_code != 200:
+            stats.incr('freeze.failed')
+            break
+        write(get_path(cslug, tslug, page), response.content)
+        count += 1
+    stats.incr('freeze.pages', count)
+    return count
+
+def freeze(limit=100):
+    '''
+    Freezes up to limit queued threads if they are closed and public, and
+    thaws the others. Returns how many threads were taken from the queue.
+    Threads that fail to be written, thawed meanwhile by an edit for one,
+    are queued again.
+
+    '''
+    slugs = set([tuple(item) for item in queue.pop_many(limit)])
+    if not slugs:
+        return 0
+
+    threads = {}
+    for thread in Thread.objects.filter(closed=True, private=False,
+            slug__in=[tslug for cslug, tslug in slugs]).select_related('category'):
+        threads[(thread.category.slug, thread.slug)] = thread
+
+    client = Client()
+    for item in slugs:
+        if item in threads:
+            try:
+                freeze_thread(threads[item], client)
+            except (IOError, OSError):
+                stats.incr('freeze.errors')
+                queue.put(item)
+        else:
+            # Reopened, or thawed while being frozen.
+            thaw([item])
+    stats.flush()
+    return len(slugs)
+
+def get_response(request, cslug, tslug):
+    '''
+    Returns a response serving the frozen page requested, or None if there
+    isn't one or the request isn't an anonymous GET of a plain page.
+
+    '''
+    if request.method != 'GET' or request.user.is_authenticated():
+        return None
+    page = request.GET.get('page', '1')
+    if [key for key in request.GET if key != 'page'] or not re_page.match(page):
+        return None
+
+    path = get_path(cslug, tslug, int(page))
+    gzipped = re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    try:
+        f = open(gzipped and path + '.gz' or path, 'rb')
+    except IOError:
+        return None
+    try:
+        response = HttpResponse(f.read())
+    finally:
+        f.close()
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+        response['Vary'] = 'Accept-Encoding'
+    response['Content-Length'] = str(len(response.content))
+    response.sb_final = True
+    stats.incr('freeze.served')
+    return response
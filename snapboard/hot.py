@@ -0,0 +1,172 @@
+"""
+"Hot" threads, ranked by activity decaying with a half-life of
+SB_HOT_HALF_LIFE hours.
+
+Thread.hot holds the logarithm of the thread's activity scaled to a fixed
+origin: each post adds a weight of 1 and each view SB_HOT_VIEW_WEIGHT at
+time t, as log(weight) + t / tau. Decaying every thread by the same factor
+doesn't change their order, so the scores never need to be recomputed and
+ordering by hot ranks threads by current activity. An event is an O(1)
+update of one thread, whose row is locked between reading and writing the
+score so concurrent events don't overwrite each other.
+
+The top SB_HOT_SIZE public threads, globally and per category, are cached
+as (score, id) lists that new posts update in place. They are rebuilt from
+the hot column index when missing or expired. Users who started private
+threads get theirs merged in.
+
+"""
+import math
+import time
+
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from snapboard.localcache import tiered
+from snapboard.models import Thread
+
+
+HALF_LIFE = getattr(settings, 'SB_HOT_HALF_LIFE', 24) * 60 * 60
+VIEW_WEIGHT = getattr(settings, 'SB_HOT_VIEW_WEIGHT', 0.05)
+SIZE = getattr(settings, 'SB_HOT_SIZE', 50)
+TIMEOUT = getattr(settings, 'SB_HOT_TIMEOUT', 300)
+
+TAU = HALF_LIFE / math.log(2)
+
+
+def logaddexp(a, b):
+    # log(exp(a) + exp(b)) without overflowing.
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+def add_event(score, weight, now=None):
+    '''
+    Returns score after an event of the given weight.
+
+    '''
+    event = math.log(weight) + (now or time.time()) / TAU
+    if not score:
+        return event
+    return logaddexp(score, event)
+
+def get_activity(score, now=None):
+    '''
+    Returns the decayed activity a score stands for, e.g. for display.
+
+    '''
+    if not score:
+        return 0.0
+    return math.exp(score - (now or time.time()) / TAU)
+
+
+def get_key(category_id=None):
+    return 'sb.hot.%s' % (category_id or 'all')
+
+def get_top(category_id=None):
+    '''
+    Returns the cached (score, id) list of the hottest public threads.
+
+    '''
+    key = get_key(category_id)
+    top = tiered.get(key)
+    if top is None:
+        qs = Thread.objects.filter(private=False)
+        if category_id is not None:
+            qs = qs.filter(category=category_id)
+        top = list(qs.order_by('-hot').values_list('hot', 'pk')[:SIZE])
+        tiered.set(key, top, TIMEOUT)
+    return top
+
+def update_top(thread):
+    '''
+    Moves thread to its place in the cached lists, after its score changed.
+
+    '''
+    if thread.private:
+        return
+    for key in (get_key(), get_key(thread.category_id)):
+        top = tiered.get(key)
+        if top is None:
+            continue
+        top = [entry for entry in top if entry[1] != thread.pk]
+        top.append((thread.hot, thread.pk))
+        top.sort(reverse=True)
+        tiered.set(key, top[:SIZE], TIMEOUT)
+
+def forget(category_ids):
+    # Rebuilds the lists on their next read.
+    for key in [get_key()] + [get_key(pk) for pk in category_ids]:
+        tiered.delete(key)
+
+def lock_scores(thread_ids, using=None):
+    '''
+    Returns the scores of the given threads as a dict of thread id -> score,
+    locking their rows until the end of the transaction. SQLite has no row
+    locks, its writes are serialized.
+
+    '''
+    if using is None:
+        using = router.db_for_write(Thread)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    sql = 'SELECT %s, %s FROM %s WHERE %s IN (%s)' % (
+        qn(Thread._meta.pk.column), qn(Thread._meta.get_field('hot').column),
+        qn(Thread._meta.db_table), qn(Thread._meta.pk.column), 
+        ', '.join(['%s'] * len(thread_ids)))
+    if not connection.settings_dict['ENGINE'].endswith('sqlite3'):
+        sql += ' FOR UPDATE'
+    cursor = connection.cursor()
+    cursor.execute(sql, list(thread_ids))
+    return dict(cursor.fetchall())
+
+@transaction.commit_on_success
+def add_post(thread, now=None):
+    score = lock_scores([thread.pk]).get(thread.pk, 0.0)
+    thread.hot = add_event(score, 1.0, now)
+    Thread.objects.filter(pk=thread.pk).update(hot=thread.hot)
+
+def record_post(thread, now=None):
+    '''
+    Adds a post to the score of thread.
+
+    '''
+    add_post(thread, now)
+    update_top(thread)
+
+def get_hot_threads(user, category=None, limit=20):
+    '''
+    Returns the hottest threads user can see, with the most recent activity
+    first.
+
+    '''
+    category_id = category and category.pk or None
+    if user.is_staff:
+        qs = Thread.objects.all()
+        if category_id is not None:
+            qs = qs.filter(category=category_id)
+        return list(qs.order_by('-hot')[:limit])
+
+    top = get_top(category_id)
+    if user.is_authenticated():
+        private_ids = Thread.objects.get_private_ids(user.pk)
+        if private_ids:
+            qs = Thread.objects.filter(pk__in=private_ids, private=True)
+            if category_id is not None:
+                qs = qs.filter(category=category_id)
+            top = sorted(top + list(qs.values_list('hot', 'pk')),
+                reverse=True)
+
+    # The lists may be a little stale: check the threads are still public,
+    # or the user's own, and in the category.
+    threads = Thread.objects.in_bulk([pk for score, pk in top[:limit * 2]])
+    result = []
+    for score, pk in top:
+        thread = threads.get(pk)
+        if thread is None or (category_id and thread.category_id != category_id) \
+                or (thread.private and thread.user_id != user.pk):
+            continue
+        result.append(thread)
+        if len(result) == limit:
+            break
+    return result
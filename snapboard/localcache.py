@@ -0,0 +1,147 @@
+"""
+An in-process LRU in front of the shared cache.
+
+Only route small values through ``tiered``: cache generations (the
+``updated.<path>`` prefixes), counters, flags. Values read from the local 
+tier may be up to SB_LOCAL_CACHE_TIMEOUT seconds old; callers that can't 
+accept that use the local value as a guess and validate it against the shared
+cache in the same round trip (see ``get_cached_response``).
+
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from snapboard import stats
+
+
+LOCAL_CACHE_TIMEOUT = getattr(settings, 'SB_LOCAL_CACHE_TIMEOUT', 2)
+LOCAL_CACHE_SIZE = getattr(settings, 'SB_LOCAL_CACHE_SIZE', 2000)
+
+
+class LRUCache(object):
+    """
+    A bounded dict with per-entry expiry. When full, the least recently used
+    quarter of the entries is dropped at once.
+    
+    """
+    def __init__(self, max_entries=LOCAL_CACHE_SIZE, timeout=LOCAL_CACHE_TIMEOUT):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = {} # key -> [value, expires, last used]
+        self._lock = threading.Lock()
+        self._tick = 0
+    
+    def get(self, key, default=None, stale=False):
+        '''
+        Returns the value stored for key. With stale=True, expired values are
+        returned too.
+        
+        '''
+        entry = self._data.get(key)
+        if entry is None or (not stale and entry[1] < time.time()):
+            return default
+        self._tick += 1
+        entry[2] = self._tick
+        return entry[0]
+    
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        self._lock.acquire()
+        try:
+            if key not in self._data and len(self._data) >= self.max_entries:
+                self._cull()
+            self._tick += 1
+            self._data[key] = [value, time.time() + timeout, self._tick]
+        finally:
+            self._lock.release()
+    
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+        finally:
+            self._lock.release()
+    
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+        finally:
+            self._lock.release()
+    
+    def _cull(self):
+        entries = sorted(self._data.items(), key=lambda item: item[1][2])
+        for key, entry in entries[:max(len(entries) // 4, 1)]:
+            self._data.pop(key, None)
+    
+    def __len__(self):
+        return len(self._data)
+
+
+_missing = object()
+
+class TieredCache(object):
+    """
+    Reads go to the local LRU first and fall back to the shared cache; 
+    writes go to both. Hit and miss counts of each tier are kept in
+    ``snapboard.stats``.
+    
+    """
+    def __init__(self, shared, local):
+        self.shared = shared
+        self.local = local
+    
+    def get(self, key, default=None):
+        value = self.local.get(key, _missing)
+        if value is not _missing:
+            stats.incr('localcache.hit')
+            return value
+        stats.incr('localcache.miss')
+        
+        value = self.shared.get(key, _missing)
+        if value is _missing:
+            stats.incr('sharedcache.miss')
+            return default
+        stats.incr('sharedcache.hit')
+        self.local.set(key, value)
+        return value
+    
+    def get_many(self, keys):
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key, _missing)
+            if value is _missing:
+                missing.append(key)
+            else:
+                found[key] = value
+        stats.incr('localcache.hit', len(found))
+        if missing:
+            stats.incr('localcache.miss', len(missing))
+            fetched = self.shared.get_many(missing)
+            stats.incr('sharedcache.hit', len(fetched))
+            stats.incr('sharedcache.miss', len(missing) - len(fetched))
+            for key, value in fetched.items():
+                self.local.set(key, value)
+            found.update(fetched)
+        return found
+    
+    def set(self, key, value, timeout=None):
+        self.shared.set(key, value, timeout)
+        self.local.set(key, value)
+    
+    def set_many(self, data, timeout=None):
+        self.shared.set_many(data, timeout)
+        for key, value in data.items():
+            self.local.set(key, value)
+    
+    def delete(self, key):
+        self.shared.delete(key)
+        self.local.delete(key)
+
+
+tiered = TieredCache(cache, LRUCache())
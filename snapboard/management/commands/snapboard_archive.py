@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from snapboard import archive
+from snapboard.models import ArchivedThread
+
+
+class Command(NoArgsCommand):
+    help = 'Moves inactive threads to the archive, or restores one.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', type='int', dest='days', 
+            default=archive.ARCHIVE_AFTER_DAYS,
+            help='Archive threads without posts for this many days.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=100,
+            help='Threads moved per batch.'),
+        make_option('--restore', type='int', dest='restore', default=None,
+            help='Id of an archived thread to restore instead.'),
+    )
+    
+    def handle_noargs(self, **options):
+        if options['restore'] is not None:
+            try:
+                thread = ArchivedThread.objects.using(archive.get_archive_db()) \
+                    .get(pk=options['restore'])
+            except ArchivedThread.DoesNotExist:
+                raise CommandError('No archived thread with id %s.' % options['restore'])
+            archive.restore_thread(thread)
+            print 'Restored "%s".' % thread
+            return
+        
+        count = archive.archive(options['days'], options['batch_size'])
+        print 'Archived %i thread(s).' % count
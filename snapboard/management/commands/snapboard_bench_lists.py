@@ -0,0 +1,74 @@
+import sys
+import time
+import types
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from snapboard.models import Thread, THREADS_PER_PAGE
+
+
+def get_size(obj, seen=None):
+    # Bytes held by obj and what it references, shared objects counted once.
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, (type, types.ModuleType)):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += get_size(key, seen) + get_size(value, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += get_size(item, seen)
+    if hasattr(obj, '__dict__'):
+        size += get_size(obj.__dict__, seen)
+    for name in getattr(type(obj), '__slots__', ()):
+        size += get_size(getattr(obj, name, None), seen)
+    return size
+
+def display(threads, user, category):
+    # What the list templates read of each thread.
+    for thread in threads:
+        (thread.name, thread.date, thread.sticky, thread.closed, 
+            thread.get_url(), user(thread), category(thread))
+
+
+class Command(NoArgsCommand):
+    help = 'Compares fetching a page of the thread list as model instances ' \
+        'and as rows.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--limit', type='int', dest='limit',
+            default=THREADS_PER_PAGE, help='Threads per page.'),
+        make_option('--repeat', type='int', dest='repeat', default=20,
+            help='Pages fetched per method, the fastest one is reported.'),
+    )
+
+    def handle_noargs(self, **options):
+        limit = options['limit']
+        qs = Thread.objects.filter(private=False).order_by('-sticky', '-date')
+        methods = (
+            ('instances', lambda: qs[:limit],
+                lambda t: t.user.username, lambda t: t.category.name),
+            ('select_related', lambda: qs.select_related('user', 'category')[:limit],
+                lambda t: t.user.username, lambda t: t.category.name),
+            ('rows', lambda: Thread.objects.rows(qs)[:limit],
+                lambda t: t.username, lambda t: t.category_name),
+        )
+
+        count = len(qs[:limit])
+        if not count:
+            raise CommandError('There are no public threads to fetch.')
+        print '%i thread(s) per page, best of %i.' % (count, options['repeat'])
+        for name, fetch, user, category in methods:
+            best = None
+            for i in range(options['repeat']):
+                start = time.time()
+                threads = list(fetch())
+                display(threads, user, category)
+                elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            size = get_size(threads) // count
+            print '%-16s %8.2f ms/page %8i bytes/thread' % (name, best * 1000, size)
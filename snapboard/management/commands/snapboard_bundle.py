@@ -0,0 +1,20 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from snapboard import bundles
+
+
+class Command(NoArgsCommand):
+    help = 'Builds the content-hashed static bundles and their manifest.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--output', dest='output', default=bundles.BUNDLE_ROOT,
+            help='Directory the bundles are written to.'),
+    )
+    
+    def handle_noargs(self, **options):
+        if bundles.jsmin is None:
+            print 'jsmin is not installed, scripts are not minified.'
+        manifest = bundles.build(bundle_root=options['output'])
+        for name, filename in sorted(manifest.items()):
+            print '%s -> %s' % (name, filename)
@@ -0,0 +1,109 @@
+from optparse import make_option
+
+from django.contrib.auth.models import User, AnonymousUser
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connections, router
+
+from snapboard.managers import MergedQuerySet
+from snapboard.models import Category, Thread, Post, THREADS_PER_PAGE, \
+    POSTS_PER_PAGE
+
+
+# Plan fragments revealing a full table scan, per database engine. MySQL
+# gives the type ALL, matched as a word of the space-joined plan row.
+SCAN_MARKERS = {
+    'sqlite': ('SCAN TABLE', 'SCAN '),
+    'postgresql': ('Seq Scan',),
+    'mysql': (' ALL ',),
+}
+# Plan fragments revealing a sort of the results.
+SORT_MARKERS = ('TEMP B-TREE', 'Sort', 'filesort')
+
+
+def head(qs, limit):
+    if isinstance(qs, MergedQuerySet):
+        return MergedQuerySet(*[part[:limit] for part in qs.querysets])
+    return qs[:limit]
+
+
+class Command(NoArgsCommand):
+    help = 'Prints the query plans of the forum views and flags table scans.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--user', dest='username', default=None,
+            help='Plan the queries as seen by this user.'),
+    )
+    
+    def get_queries(self, user):
+        anonymous = AnonymousUser()
+        yield 'category_list', Category.objects.all()
+        
+        categories = Category.objects.all()[:1]
+        if categories:
+            threads = categories[0].thread_set
+            yield 'category (anonymous)', head(Thread.objects.rows(
+                threads.get_user_query_set(anonymous)), THREADS_PER_PAGE)
+            yield 'category (user)', head(Thread.objects.rows(
+                threads.get_user_query_set(user)), THREADS_PER_PAGE)
+        
+        yield 'thread_list', head(Thread.objects.rows(Thread.objects
+            .get_user_query_set(user).order_by('-date')), THREADS_PER_PAGE)
+        yield 'hot', Thread.objects.filter(private=False).order_by('-hot')[:50]
+        if user.is_authenticated():
+            yield 'favorites', Thread.objects.rows(
+                Thread.objects.favorites(user))[:THREADS_PER_PAGE]
+        
+        thread = Thread.objects.all()[:1]
+        if thread:
+            thread = thread[0]
+            yield 'thread', thread.get_posts()[:POSTS_PER_PAGE]
+            yield 'thread (last post)', thread.post_set.order_by('-date')[:1]
+        
+        yield 'feeds', Post.objects.filter(thread__private=False) \
+            .order_by('-date')[:10]
+    
+    def handle_noargs(self, **options):
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError('No user named "%s".' % options['username'])
+        else:
+            user = AnonymousUser()
+        
+        scans = 0
+        queries = []
+        for name, qs in self.get_queries(user):
+            # Merged querysets run one query per stream.
+            parts = getattr(qs, 'querysets', [qs])
+            for i, part in enumerate(parts):
+                queries.append((len(parts) > 1 and '%s #%i' % (name, i + 1)
+                    or name, part))
+        
+        for name, qs in queries:
+            using = router.db_for_read(qs.model)
+            connection = connections[using]
+            engine = connection.settings_dict['ENGINE']
+            vendor = [v for v in SCAN_MARKERS if v in engine]
+            vendor = vendor and vendor[0] or None
+            
+            sql, params = qs.query.get_compiler(using).as_sql()
+            explain = vendor == 'sqlite' and 'EXPLAIN QUERY PLAN ' or 'EXPLAIN '
+            cursor = connection.cursor()
+            cursor.execute(explain + sql, params)
+            plan = [' '.join([unicode(c) for c in row]) for row in cursor.fetchall()]
+            
+            print '== %s' % name
+            print sql % tuple([repr(p) for p in params])
+            for line in plan:
+                flag = ''
+                if [m for m in SCAN_MARKERS.get(vendor, ()) if m in ' %s ' % line] \
+                        and 'USING INDEX' not in line \
+                        and 'USING COVERING INDEX' not in line:
+                    flag = '   <-- sequential scan'
+                    scans += 1
+                elif [m for m in SORT_MARKERS if m in line]:
+                    flag = '   <-- sort'
+                print '  %s%s' % (line, flag)
+            print
+        
+        print '%i sequential scan(s) found.' % scans
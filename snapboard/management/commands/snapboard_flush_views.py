@@ -0,0 +1,21 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from snapboard import viewcounts
+
+
+class Command(NoArgsCommand):
+    help = 'Adds the thread views counted in the cache to the threads.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--loop', action='store_true', dest='loop', default=False,
+            help='Keep flushing every epoch.'),
+    )
+    
+    def handle_noargs(self, **options):
+        while True:
+            print '%i views added.' % viewcounts.flush()
+            if not options['loop']:
+                break
+            time.sleep(viewcounts.EPOCH)
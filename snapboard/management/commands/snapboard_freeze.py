@@ -0,0 +1,37 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from snapboard import freezer
+from snapboard.models import Thread
+
+
+class Command(NoArgsCommand):
+    help = 'Writes static pages of the closed threads queued for freezing.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Queue every closed public thread first.'),
+        make_option('--loop', action='store_true', dest='loop', default=False,
+            help='Keep draining the queue instead of exiting when it is empty.'),
+        make_option('--interval', type='float', dest='interval', default=1.0,
+            help='Seconds to sleep when the queue is empty (with --loop).'),
+        make_option('--limit', type='int', dest='limit', default=100,
+            help='Number of threads taken from the queue at a time.'),
+    )
+    
+    def handle_noargs(self, **options):
+        if not freezer.FREEZE_ROOT:
+            raise CommandError('Set SB_FREEZE_ROOT to freeze closed threads.')
+        verbosity = int(options.get('verbosity', 1))
+        if options['all']:
+            freezer.enqueue(Thread.objects.filter(closed=True, private=False)
+                .values_list('category__slug', 'slug').iterator())
+        while True:
+            count = freezer.freeze(options['limit'])
+            if count and verbosity > 1:
+                print 'Processed %i thread(s).' % count
+            if not count:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
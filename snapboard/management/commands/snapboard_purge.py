@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand, CommandError
+
+from snapboard import moderation
+
+
+class Command(NoArgsCommand):
+    help = 'Deletes all posts and threads by a user or from an IP address.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--user', dest='username', default=None,
+            help='Username whose posts and threads are deleted.'),
+        make_option('--ip', dest='ip', default=None,
+            help='IP address whose posts are deleted.'),
+        make_option('--batch-size', type='int', dest='batch_size', 
+            default=moderation.BATCH_SIZE, help='Rows deleted per statement.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', 
+            default=False, help='Report what would be deleted, delete nothing.'),
+    )
+    
+    def handle_noargs(self, **options):
+        user = None
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError('No user named "%s".' % options['username'])
+        if user is None and not options['ip']:
+            raise CommandError('Give --user or --ip.')
+        
+        report = moderation.purge(user, options['ip'], options['batch_size'],
+            options['dry_run'])
+        if options['dry_run']:
+            print 'Dry run, nothing was deleted.'
+        print 'Posts deleted:    %(posts)i' % report
+        print 'Threads deleted:  %(threads)i' % report
+        print 'Threads updated:  %(updated_threads)i' % report
@@ -0,0 +1,26 @@
+from django.core.management.base import NoArgsCommand
+
+from snapboard.models import Category, UserSettings
+
+
+FIELDS = ('thread_count', 'post_count', 'last_post_id')
+
+
+class Command(NoArgsCommand):
+    help = 'Recomputes the category and user thread and post counts.'
+    
+    def handle_noargs(self, **options):
+        before = dict((values[0], values[1:]) for values in 
+            Category.objects.values_list('pk', *FIELDS))
+        Category.objects.refresh_rollups()
+        
+        fixed = 0
+        for values in Category.objects.values_list('pk', 'name', *FIELDS):
+            if before.get(values[0]) != values[2:]:
+                fixed += 1
+                print 'Fixed %s: %s threads, %s posts.' % (values[1], 
+                    values[2], values[3])
+        print '%i categories fixed.' % fixed
+        
+        UserSettings.objects.refresh_stats()
+        print 'User counters recomputed.'
@@ -0,0 +1,43 @@
+import gzip
+import os
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+
+from snapboard import sitemaps
+
+
+class Command(NoArgsCommand):
+    help = 'Writes the gzipped sitemap index and sitemaps to a directory.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--output', dest='output', 
+            default=getattr(settings, 'SB_SITEMAP_ROOT', None),
+            help='Directory served at the URL of the sitemap views.'),
+    )
+    
+    def write(self, path, content):
+        # Replaces the file at once, the web server may be serving it.
+        f = gzip.open(path + '.tmp', 'wb', 9)
+        try:
+            for piece in content:
+                f.write(piece)
+        finally:
+            f.close()
+        os.rename(path + '.tmp', path)
+    
+    def handle_noargs(self, **options):
+        output = options['output']
+        if not output:
+            raise CommandError('Give --output or set SB_SITEMAP_ROOT.')
+        if not os.path.isdir(output):
+            os.makedirs(output)
+        
+        base_url = sitemaps.get_base_url()
+        chunks = sitemaps.get_chunks()
+        for chunk, lastmod in chunks:
+            self.write(os.path.join(output, 'sitemap-%i.xml.gz' % chunk),
+                sitemaps.generate(chunk, base_url))
+        self.write(os.path.join(output, 'sitemap.xml.gz'), 
+            sitemaps.generate_index(base_url))
+        print '%i sitemap(s) written.' % len(chunks)
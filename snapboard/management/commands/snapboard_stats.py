@@ -0,0 +1,22 @@
+from django.core.management.base import NoArgsCommand
+
+from snapboard import stats
+
+
+class Command(NoArgsCommand):
+    help = 'Prints the cache and worker counters.'
+    
+    def handle_noargs(self, **options):
+        totals = stats.get_stats()
+        for name, value in sorted(totals.items()):
+            print '%-40s %i' % (name, value)
+        
+        # Hit ratios of the cache tiers.
+        for name in sorted(totals):
+            if not name.endswith('.hit'):
+                continue
+            hits = totals[name]
+            misses = totals.get(name[:-4] + '.miss', 0)
+            if hits + misses:
+                print '%-40s %.1f%%' % (name[:-4] + ' hit ratio', 
+                    100.0 * hits / (hits + misses))
@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from snapboard.models import APIToken
+
+
+class Command(BaseCommand):
+    help = 'Issues, rotates or revokes API tokens for a staff user.'
+    args = '<username>'
+    option_list = BaseCommand.option_list + (
+        make_option('--rotate', action='store_true', dest='rotate',
+            default=False, help='Revoke existing tokens before issuing a new one.'),
+        make_option('--revoke', action='store_true', dest='revoke',
+            default=False, help='Revoke existing tokens without issuing a new one.'),
+    )
+    
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: snapboard_token [--rotate|--revoke] <username>')
+        try:
+            user = User.objects.get(username=args[0])
+        except User.DoesNotExist:
+            raise CommandError('No user named "%s".' % args[0])
+        
+        if options['revoke']:
+            count = APIToken.objects.revoke(user)
+            print 'Revoked %i token(s) for %s.' % (count, user)
+            return
+        
+        if not user.is_staff:
+            raise CommandError('API tokens are only accepted for staff users.')
+        
+        if options['rotate']:
+            key = APIToken.objects.rotate(user)
+        else:
+            key = APIToken.objects.create_token(user)
+        # The key can't be recovered later, only its digest is stored.
+        print key
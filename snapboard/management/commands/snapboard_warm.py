@@ -0,0 +1,29 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from snapboard import warmer
+
+
+class Command(NoArgsCommand):
+    help = 'Renders pages queued for warming after cache invalidations.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--loop', action='store_true', dest='loop', default=False,
+            help='Keep draining the queue instead of exiting when it is empty.'),
+        make_option('--interval', type='float', dest='interval', default=1.0,
+            help='Seconds to sleep when the queue is empty (with --loop).'),
+        make_option('--limit', type='int', dest='limit', default=100,
+            help='Number of paths taken from the queue at a time.'),
+    )
+    
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        while True:
+            count = warmer.warm(options['limit'])
+            if count and verbosity > 1:
+                print 'Warmed %i page(s).' % count
+            if not count:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
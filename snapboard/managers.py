@@ -1,21 +1,209 @@
-from django.db import models
-from django.db.models import Q
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, F, Max, Q
+from django.db.models.query import QuerySet, ValuesListQuerySet
 from django.template.defaultfilters import slugify
 
 
+class CategoryManager(models.Manager):
+    def refresh_rollups(self, category_ids=None):
+        '''
+        Recomputes the thread and post counts and the last post of the given
+        categories, or of all of them.
+        
+        '''
+        from snapboard.models import Thread, Post
+        
+        categories = self.all()
+        if category_ids is not None:
+            categories = categories.filter(pk__in=list(category_ids))
+        category_ids = list(categories.values_list('pk', flat=True))
+        
+        threads = dict(Thread.objects.filter(category__in=category_ids)
+            .values_list('category').annotate(Count('pk')).order_by())
+        posts = dict(Post.objects.filter(thread__category__in=category_ids)
+            .values_list('thread__category').annotate(Count('pk')).order_by())
+        for pk in category_ids:
+            last = Post.objects.filter(thread__category=pk).order_by('-date') \
+                .values_list('id', 'date', 'user__username')[:1]
+            last = last and last[0] or (None, None, '')
+            self.filter(pk=pk).update(thread_count=threads.get(pk, 0),
+                post_count=posts.get(pk, 0), last_post_id=last[0],
+                last_post_date=last[1], last_post_user=last[2])
+
+
+def keyset_filter(qs, ordering, values):
+    '''
+    Filters qs down to the rows that come after values in ordering, a list of
+    field names as given to order_by().
+    
+    '''
+    q = None
+    for i in reversed(range(len(ordering))):
+        name = ordering[i].lstrip('-')
+        lookup = ordering[i].startswith('-') and 'lt' or 'gt'
+        after = Q(**{'%s__%s' % (name, lookup): values[i]})
+        if q is not None:
+            after |= Q(**{name: values[i]}) & q
+        q = after
+    return qs.filter(q)
+
+
+class MergedQuerySet(object):
+    """
+    The rows of several querysets with the same ordering and no rows in 
+    common, in that ordering. Each queryset is read in index order and only 
+    as far as the requested slice, then the streams are merged.
+    
+    Supports what the views and django-pagination need: filter(), exclude(),
+    order_by(), count(), len(), iteration, slicing and keyset pages with 
+    after().
+    
+    """
+    def __init__(self, *querysets):
+        self.querysets = querysets
+        self.model = querysets[0].model
+        self.ordering = list(querysets[0].query.order_by)
+        self._result_cache = None
+    
+    def _apply(self, method, *args, **kwargs):
+        return MergedQuerySet(*[getattr(qs, method)(*args, **kwargs) 
+            for qs in self.querysets])
+    
+    def all(self):
+        return self._apply('all')
+    
+    def filter(self, *args, **kwargs):
+        return self._apply('filter', *args, **kwargs)
+    
+    def exclude(self, *args, **kwargs):
+        return self._apply('exclude', *args, **kwargs)
+    
+    def order_by(self, *fields):
+        return self._apply('order_by', *fields)
+    
+    def select_related(self, *fields):
+        return self._apply('select_related', *fields)
+    
+    def after(self, *values):
+        '''
+        Returns the rows following the row with the given ordering values.
+        
+        '''
+        return MergedQuerySet(*[keyset_filter(qs, self.ordering, values) 
+            for qs in self.querysets])
+    
+    def count(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        return sum([qs.count() for qs in self.querysets])
+    
+    def exists(self):
+        return bool([qs for qs in self.querysets if qs.exists()])
+    
+    def __len__(self):
+        if self._result_cache is None:
+            self._result_cache = self._merge([list(qs) for qs in self.querysets])
+        return len(self._result_cache)
+    
+    def __iter__(self):
+        len(self)
+        return iter(self._result_cache)
+    
+    def __getitem__(self, k):
+        if self._result_cache is not None:
+            return self._result_cache[k]
+        if not isinstance(k, slice):
+            return self[k:k + 1][0]
+        if k.stop is None or k.step is not None:
+            return list(self)[k]
+        # Every stream could hold all the rows up to k.stop.
+        return self._merge([list(qs[:k.stop]) for qs in self.querysets])[k]
+    
+    def _compare(self, a, b):
+        for field in self.ordering:
+            name = field.lstrip('-')
+            if name == 'pk':
+                name = self.model._meta.pk.attname
+            result = cmp(getattr(a, name), getattr(b, name))
+            if result:
+                return field.startswith('-') and -result or result
+        return 0
+    
+    def _merge(self, streams):
+        merged = streams[0]
+        for stream in streams[1:]:
+            result = []
+            i = j = 0
+            while i < len(merged) and j < len(stream):
+                if self._compare(stream[j], merged[i]) < 0:
+                    result.append(stream[j])
+                    j += 1
+                else:
+                    result.append(merged[i])
+                    i += 1
+            merged = result + merged[i:] + stream[j:]
+        return merged
+
+
+PRIVATE_IDS_TIMEOUT = getattr(settings, 'SB_PRIVATE_IDS_TIMEOUT', 300)
+
+
 class ThreadManager(models.Manager):
     def get_user_query_set(self, user):
-        # Filter private posts.
+        '''
+        Returns the threads user can see. Users who started private threads get
+        the public threads merged with theirs, rather than an OR which keeps 
+        the database from reading the threads in index order.
+        
+        '''
         qs = self.get_query_set().order_by('-sticky', '-date')
         if user.is_staff:
             return qs
+        public = qs.filter(private=False)
         if user.is_authenticated():
-            return qs.filter(Q(private=False) | Q(private=True) & Q(user=user))
-        return qs.filter(private=False)
+            private_ids = self.get_private_ids(user.pk)
+            if private_ids:
+                return MergedQuerySet(public, 
+                    qs.filter(private=True, pk__in=private_ids))
+        return public
+    
+    def get_private_ids(self, user_id):
+        '''
+        Returns the ids of the private threads started by the user, cached.
+        
+        '''
+        from snapboard.localcache import tiered
         
+        key = 'sb.private.%s' % user_id
+        ids = tiered.get(key)
+        if ids is None:
+            # Not self: on a related manager self is limited to a category.
+            ids = list(self.model._default_manager.filter(private=True, 
+                user=user_id).values_list('pk', flat=True))
+            tiered.set(key, ids, PRIVATE_IDS_TIMEOUT)
+        return ids
+    
+    def forget_private_ids(self, user_ids):
+        from snapboard.localcache import tiered
+        
+        for user_id in set(user_ids):
+            tiered.delete('sb.private.%s' % user_id)
+        
+    @transaction.commit_on_success
     def create_thread(self, **kwargs):
+        from snapboard.models import Category, UserSettings
+        
         kwargs['slug'] = self.get_slug(kwargs['name'])
-        return self.create(**kwargs)
+        thread = self.create(**kwargs)
+        Category.objects.filter(pk=thread.category_id) \
+            .update(thread_count=F('thread_count') + 1)
+        UserSettings.objects.record(thread.user_id, threads=1)
+        return thread
     
     def get_slug(self, slug):
         '''
@@ -23,7 +211,12 @@ class ThreadManager(models.Manager):
         
         '''
         # TODO: Unique within Category is good enough?
-        get = lambda: self.filter(slug=slug)
+        from snapboard.archive import is_slug_archived
+        from snapboard.models import SlugHistory
+        # Old slugs redirect to their thread, a new thread can't take them.
+        old = SlugHistory.objects.filter(kind=SlugHistory.THREAD)
+        get = lambda: self.filter(slug=slug).exists() \
+            or old.filter(slug=slug).exists() or is_slug_archived(slug)
         slug = s = slugify(slug)
         counter = 1
         while get():
@@ -31,6 +224,16 @@ class ThreadManager(models.Manager):
             counter += 1
         return slug
     
+    def rows(self, qs):
+        '''
+        Returns qs, a queryset of threads or a MergedQuerySet, fetching 
+        ThreadRows for the thread lists.
+        
+        '''
+        if isinstance(qs, MergedQuerySet):
+            return MergedQuerySet(*[self.rows(part) for part in qs.querysets])
+        return qs.values_list(*ThreadRow.fields)._clone(klass=ThreadRowQuerySet)
+    
     def favorites(self, user):
         ''''
         Returns threads watched or owned by user.
@@ -40,7 +243,135 @@ class ThreadManager(models.Manager):
         return self.filter(Q(user=user) | Q(pk__in=watch_pks)).order_by('-date')
 
 
+class AuthorStatsQuerySet(QuerySet):
+    """
+    Posts fetched with their authors, whose UserSettings are loaded in one 
+    query for all the posts rather than one per author.
+    
+    """
+    def iterator(self):
+        from snapboard.models import UserSettings
+        
+        posts = list(super(AuthorStatsQuerySet, self).iterator())
+        UserSettings.objects.attach([post.user for post in posts])
+        return iter(posts)
+
+
+class RowUser(object):
+    """
+    The author of a ThreadRow, with what the templates read of a User.
+    
+    """
+    __slots__ = ('id', 'username')
+    
+    def __init__(self, id, username):
+        self.id, self.username = id, username
+    
+    def __unicode__(self):
+        return self.username
+    
+    @property
+    def pk(self):
+        return self.id
+
+
+class RowCategory(object):
+    """
+    The category of a ThreadRow, with what the templates read of a Category.
+    
+    """
+    __slots__ = ('id', 'name', 'slug')
+    
+    def __init__(self, id, name, slug):
+        self.id, self.name, self.slug = id, name, slug
+    
+    def __unicode__(self):
+        return self.name
+    
+    @property
+    def pk(self):
+        return self.id
+    
+    def get_url(self):
+        from django.core.urlresolvers import reverse
+        return reverse('sb_category', args=(self.slug,))
+    get_absolute_url = get_url
+
+
+class ThreadRow(object):
+    """
+    What the thread lists display of a thread: a tuple of columns rather than
+    a model instance with its user and category instances. ``user`` and 
+    ``category`` are RowUser and RowCategory, their names are also in 
+    ``username`` and ``category_name``. The Thread methods the templates
+    call run the same queries as on a Thread.
+    
+    """
+    columns = ('id', 'name', 'slug', 'date', 'sticky', 'closed', 'private',
+        'views', 'user_id', 'username', 'category_id', 'category_name', 
+        'category_slug')
+    __slots__ = columns + ('user', 'category')
+    # The values_list() fields of the columns.
+    fields = ('id', 'name', 'slug', 'date', 'sticky', 'closed', 'private',
+        'views', 'user', 'user__username', 'category', 'category__name', 
+        'category__slug')
+    
+    def __init__(self, row):
+        for name, value in zip(self.columns, row):
+            setattr(self, name, value)
+        self.user = RowUser(self.user_id, self.username)
+        self.category = RowCategory(self.category_id, self.category_name, 
+            self.category_slug)
+    
+    def __unicode__(self):
+        return self.name
+    
+    @property
+    def pk(self):
+        return self.id
+    
+    def as_thread(self):
+        # An unsaved Thread with the row's columns, for its methods.
+        from snapboard.models import Thread
+        return Thread(id=self.id, name=self.name, slug=self.slug, 
+            date=self.date, sticky=self.sticky, closed=self.closed, 
+            private=self.private, views=self.views, user_id=self.user_id, 
+            category_id=self.category_id)
+    
+    def get_post_count(self):
+        return self.as_thread().get_post_count()
+    
+    def get_page_count(self):
+        return self.as_thread().get_page_count()
+    
+    def get_last_post(self):
+        return self.as_thread().get_last_post()
+    
+    def is_fav(self, u):
+        return self.as_thread().is_fav(u)
+    
+    def get_url(self):
+        from django.core.urlresolvers import reverse
+        return reverse('sb_thread', args=(self.category_slug, self.slug))
+    get_absolute_url = get_url
+
+
+class ThreadRowQuerySet(ValuesListQuerySet):
+    """
+    Threads fetched as ThreadRows, with their user and category names joined
+    in the same query.
+    
+    """
+    def iterator(self):
+        for row in super(ThreadRowQuerySet, self).iterator():
+            yield ThreadRow(row)
+
+
 class PostManager(models.Manager):
+    def with_author_stats(self):
+        return self.get_query_set().select_related('user') \
+            ._clone(klass=AuthorStatsQuerySet)
+    
     def get_user_query_set(self, user):
         qs = self.get_query_set()
         if user.is_staff:
@@ -49,8 +380,33 @@ class PostManager(models.Manager):
             return qs.filter(user=user)
         return qs.none()
 
-    def create_and_notify(self, thread, user, **kwargs):
+    @transaction.commit_on_success
+    def create_post(self, thread, user, **kwargs):
+        '''
+        Creates a post and updates the thread and category it belongs to in
+        the same transaction.
+        
+        '''
+        from snapboard.models import Category, UserSettings
+        
         post = self.create(thread=thread, user=user, **kwargs)
+        # Only the date: saving the thread would send its signals with every 
+        # post.
+        thread.date = post.date
+        type(thread)._default_manager.filter(pk=thread.pk).update(date=post.date)
+        Category.objects.filter(pk=thread.category_id).update(
+            post_count=F('post_count') + 1, last_post_id=post.id,
+            last_post_date=post.date, last_post_user=user.username)
+        UserSettings.objects.record(user.pk, posts=1, last_post_at=post.date)
+        return post
+
+    def create_and_notify(self, thread, user, **kwargs):
+        from snapboard import hot
+        
+        post = self.create_post(thread, user, **kwargs)
+        # Pages may have been cached again before the commit.
+        post.invalidate_cache()
+        hot.record_post(thread)
         
         # Auto-watch the threads you post in.
         # user.sb_watchlist.get_or_create(thread=thread)
@@ -63,6 +419,134 @@ class PostManager(models.Manager):
         #    user.sb_watchlist.get_or_create(thread=thread)
         
         post.notify()
-        thread.date = post.date
-        thread.save()
-        return post
\ No newline at end of file
+        return post
+
+
+class UserSettingsManager(models.Manager):
+    def attach(self, users):
+        '''
+        Loads the settings of users in one query and caches them on the users,
+        so that user.sb_usersettings needs no query. Users without settings 
+        get unsaved defaults.
+        
+        '''
+        cache_name = '_%s_cache' % self.model._meta.get_field('user') \
+            .related.get_accessor_name()
+        users = [user for user in users if not hasattr(user, cache_name)]
+        found = dict((row.user_id, row) for row in 
+            self.filter(user__in=set([user.pk for user in users])))
+        for user in users:
+            setattr(user, cache_name, found.get(user.pk) or self.model(user=user))
+    
+    def record(self, user_id, posts=0, threads=0, last_post_at=None):
+        '''
+        Adds posts and threads to the counters of the user.
+        
+        '''
+        values = {
+            'post_count': F('post_count') + posts,
+            'thread_count': F('thread_count') + threads,
+        }
+        if last_post_at is not None:
+            values['last_post_at'] = last_post_at
+        if not self.filter(user=user_id).update(**values):
+            self.create(user_id=user_id, post_count=max(posts, 0), 
+                thread_count=max(threads, 0), last_post_at=last_post_at)
+    
+    def refresh_stats(self, user_ids=None):
+        '''
+        Recomputes the counters of the given users, or of everyone.
+        
+        '''
+        from snapboard.models import Thread, Post
+        
+        posts = Post.objects.all()
+        threads = Thread.objects.all()
+        if user_ids is not None:
+            user_ids = list(user_ids)
+            posts = posts.filter(user__in=user_ids)
+            threads = threads.filter(user__in=user_ids)
+        
+        post_stats = dict((pk, (count, last)) for pk, count, last in 
+            posts.values_list('user').annotate(Count('pk'), Max('date')).order_by())
+        thread_counts = dict(threads.values_list('user').annotate(Count('pk'))
+            .order_by())
+        if user_ids is None:
+            user_ids = set(post_stats) | set(thread_counts) | \
+                set(self.values_list('user', flat=True))
+        
+        for user_id in user_ids:
+            post_count, last_post_at = post_stats.get(user_id, (0, None))
+            values = {
+                'post_count': post_count,
+                'thread_count': thread_counts.get(user_id, 0),
+                'last_post_at': last_post_at,
+            }
+            if not self.filter(user=user_id).update(**values) and \
+                    (values['post_count'] or values['thread_count']):
+                self.create(user_id=user_id, **values)
+
+
+API_TOKEN_CACHE_TIMEOUT = getattr(settings, 'SB_API_TOKEN_CACHE_TIMEOUT', 60)
+API_TOKEN_CACHE_SIZE = getattr(settings, 'SB_API_TOKEN_CACHE_SIZE', 1000)
+
+# digest -> (user or None, expiry timestamp)
+_api_token_cache = {}
+
+
+class APITokenManager(models.Manager):
+    def get_digest(self, key):
+        return hashlib.sha256(key).hexdigest()
+
+    def create_token(self, user):
+        '''
+        Issues a new token for user and returns its key. Only the digest of
+        the key is stored, so the key can't be recovered later.
+        
+        '''
+        key = os.urandom(20).encode('hex')
+        self.create(user=user, digest=self.get_digest(key))
+        return key
+
+    def revoke(self, user):
+        tokens = self.filter(user=user, revoked=False)
+        for digest in tokens.values_list('digest', flat=True):
+            _api_token_cache.pop(digest, None)
+        return tokens.update(revoked=True)
+
+    def rotate(self, user):
+        '''
+        Revokes the tokens of user and issues a new one.
+        
+        '''
+        self.revoke(user)
+        return self.create_token(user)
+
+    def get_user(self, key):
+        '''
+        Returns the staff user owning the token key, or None.
+        
+        Lookups go by digest, so the key itself is never compared. Results
+        are kept in process for SB_API_TOKEN_CACHE_TIMEOUT seconds, which
+        also bounds how long a revoked token is accepted by other processes.
+        
+        '''
+        digest = self.get_digest(key)
+        now = time.time()
+        entry = _api_token_cache.get(digest)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        
+        try:
+            token = self.select_related('user').get(digest=digest, revoked=False)
+        except self.model.DoesNotExist:
+            user = None
+        else:
+            user = token.user
+            if not (user.is_active and user.is_staff):
+                user = None
+        
+        if len(_api_token_cache) >= API_TOKEN_CACHE_SIZE:
+            _api_token_cache.clear()
+        _api_token_cache[digest] = (user, now + API_TOKEN_CACHE_TIMEOUT)
+        return user
@@ -0,0 +1,27 @@
+from django.http import HttpResponseForbidden
+from django.utils.translation import ugettext as _
+
+from snapboard.bans import get_index
+
+
+def is_snapboard_view(view_func):
+    # Bans don't spread to the other applications of the project. The API 
+    # views are piston Resources, whose handlers are snapboard's.
+    view = getattr(view_func, 'handler', view_func)
+    return getattr(view, '__module__', '').startswith('snapboard.')
+
+
+class IPBanMiddleware(object):
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not is_snapboard_view(view_func):
+            return None
+        if get_index().is_ip_banned(request.META.get('REMOTE_ADDR')):
+            return HttpResponseForbidden(_('Your IP address has been banned from the forum.'))
+
+
+class UserBanMiddleware(object):
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not is_snapboard_view(view_func):
+            return None
+        if get_index().is_user_banned(request.user):
+            return HttpResponseForbidden(_('You have been banned from the forum.'))
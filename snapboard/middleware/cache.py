@@ -1,9 +1,14 @@
+import time
+
 from django.conf import settings
 from django.core.cache import cache
 from django.template import Template
 from django.template.context import RequestContext
 
-from snapboard.utils import get_response_cache_key, get_prefix_cache_key
+from snapboard import freezer, stats, viewcounts
+from snapboard.utils import get_cached_response, get_response_cache_key, \
+    get_stale_cache_key, get_lock_cache_key, needs_second_pass, \
+    unpack_response, CACHE_LOCK_TIMEOUT, CACHE_STALE_GRACE
 
 
 class CachedTemplateMiddleware(object):
@@ -14,16 +19,29 @@ class CachedTemplateMiddleware(object):
         
         response = None
         if request.method == "GET":
-            prefix_key = get_prefix_cache_key(request)
-            prefix = cache.get(prefix_key, "0")
+            prefix, record = get_cached_response(request)
+            request.sb_cache_prefix = prefix
+            
+            if record is not None:
+                response = unpack_response(record, request)
             
-            response_key = get_response_cache_key(prefix, request)
-            response = cache.get(response_key)
+            if response is None:
+                stats.incr('pagecache.miss')
+                response_key = get_response_cache_key(prefix, request)
+                response = self.render_once(request, prefix, response_key,
+                    view_func, view_args, view_kwargs)
+            else:
+                stats.incr('pagecache.hit')
         
         if response is None:
             response = view_func(request, *view_args, **view_kwargs)
         
-        if response['content-type'].startswith('text/html'):
+        if request.method == "GET" and response.status_code == 200 and \
+                getattr(view_func, 'sb_counts_views', False) and \
+                not request.META.get(freezer.FREEZING):
+            viewcounts.count_view(view_kwargs['tslug'])
+        
+        if not getattr(response, 'sb_final', False) and needs_second_pass(response):
             t = Template(response.content)
             response.content = t.render(RequestContext(request))
         
@@ -33,4 +51,50 @@ class CachedTemplateMiddleware(object):
         #       These headers help it forget ...
         response['Cache-Control'] = "private"    
         response['Expires'] = "Thu, 1 Jan 70 00:00:00 GMT"
-        return response
\ No newline at end of file
+        return response
+    
+    def render_once(self, request, prefix, response_key, view_func, view_args, 
+                    view_kwargs):
+        """
+        Renders a missing page in a single worker at a time. While a worker
+        holds the lock, the others serve the previous generation of the page
+        for up to SB_CACHE_STALE_GRACE seconds after the invalidation.
+        
+        """
+        stale_prefix = cache.get(get_stale_cache_key(request))
+        if stale_prefix is None:
+            # This page has never been cached, there's nothing to protect.
+            return None
+        
+        lock_key = get_lock_cache_key(response_key)
+        if not cache.add(lock_key, 1, CACHE_LOCK_TIMEOUT):
+            response = self.get_stale_response(request, prefix, stale_prefix)
+            if response is not None:
+                stats.incr('cache.stale_served')
+                return response
+            stats.incr('cache.lock_contended')
+            return None
+        
+        start = time.time()
+        try:
+            return view_func(request, *view_args, **view_kwargs)
+        finally:
+            cache.delete(lock_key)
+            stats.incr('cache.lock_acquired')
+            stats.incr('cache.lock_held_ms', int((time.time() - start) * 1000))
+    
+    def get_stale_response(self, request, prefix, stale_prefix):
+        try:
+            invalidated = int(prefix) / 1000.0
+        except ValueError:
+            return None
+        if str(stale_prefix) == str(prefix) or \
+                time.time() - invalidated > CACHE_STALE_GRACE:
+            return None
+        
+        record = cache.get(get_response_cache_key(stale_prefix, request))
+        if record is None:
+            return None
+        response = unpack_response(record, request)
+        response['Warning'] = '110 - "Response is stale"'
+        return response
@@ -0,0 +1,17 @@
+from snapboard import presence
+from snapboard.middleware.ban import is_snapboard_view
+
+
+class PresenceMiddleware(object):
+    """
+    Records who is reading the forum, its categories and threads, see 
+    ``snapboard.presence``. Must come after AuthenticationMiddleware and 
+    before CachedTemplateMiddleware, which answers cached pages itself.
+    
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method != 'GET' or request.is_ajax() or \
+                not is_snapboard_view(view_func):
+            return None
+        presence.touch(presence.get_member(request), 
+            presence.get_scopes(view_kwargs))
@@ -0,0 +1,20 @@
+from snapboard import routers
+
+
+class ReplicaPinningMiddleware(object):
+    """
+    Keeps the reads of clients who have just written on the primary 
+    database, see ``snapboard.routers``.
+    
+    """
+    def process_request(self, request):
+        routers.unpin()
+        if request.COOKIES.get(routers.PIN_COOKIE):
+            routers.pin_to_primary(wrote=False)
+    
+    def process_response(self, request, response):
+        if routers.has_written():
+            response.set_cookie(routers.PIN_COOKIE, '1', 
+                max_age=routers.PIN_SECONDS)
+        routers.unpin()
+        return response
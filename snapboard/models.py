@@ -5,24 +5,69 @@ from django.conf import settings
 from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 
 from snapboard.fields import SignalSlugField, fields_updated
-from snapboard.managers import ThreadManager, PostManager
+from snapboard.managers import CategoryManager, ThreadManager, PostManager, \
+    UserSettingsManager, APITokenManager
 
 
 THREADS_PER_PAGE = getattr(settings, 'SB_THREADS_PER_PAGE', 25)
 POSTS_PER_PAGE = getattr(settings, 'SB_POSTS_PER_PAGE', 25)
 MEDIA_PREFIX = getattr(settings, 'SB_MEDIA_PREFIX')
+# Database alias holding archived threads, defaults to the main database.
+ARCHIVE_DATABASE = getattr(settings, 'SB_ARCHIVE_DATABASE', None)
+
+
+def invalidate_pages(slugs, extra_paths=()):
+    '''
+    Invalidates the cached thread lists and the pages of the threads given 
+    as (category slug, thread slug) pairs, with a single cache write. A
+    thread slug of None only invalidates the category.
+    
+    '''
+    from snapboard.localcache import tiered
+    from snapboard.utils import get_prefix_cache_key, new_cache_prefix
+    
+    paths = [reverse('sb_category_list'), reverse('sb_thread_list')]
+    for cslug in set([cslug for cslug, tslug in slugs]):
+        paths.append(reverse('sb_category', args=[cslug]))
+    for cslug, tslug in set(slugs):
+        if tslug is not None:
+            paths.append(reverse('sb_thread', args=[cslug, tslug]))
+    paths.extend(extra_paths)
+    
+    prefix = new_cache_prefix()
+    tiered.set_many(dict((get_prefix_cache_key(path), prefix) for path in paths))
+    
+    from snapboard import freezer, warmer
+    if warmer.WARM_CACHE:
+        warmer.enqueue(paths)
+    if freezer.FREEZE_ROOT:
+        freezer.thaw(slugs)
+        freezer.enqueue(slugs)
 
 
 class Category(models.Model):
     name = models.CharField(max_length=64, verbose_name=_('name'))
     description = models.CharField(max_length=255, blank=True, 
         verbose_name=_('description'))
-    # slug = SignalSlugField()
-    slug = models.SlugField(max_length=255)
+    # Old slugs redirect, see snapboard.resolver.
+    slug = SignalSlugField(max_length=255)
+    
+    # Rollups kept up to date by the managers and moderation actions, see
+    # CategoryManager.refresh_rollups().
+    thread_count = models.PositiveIntegerField(default=0, editable=False)
+    post_count = models.PositiveIntegerField(default=0, editable=False)
+    # Not a foreign key: deleting the post mustn't delete the category.
+    last_post_id = models.IntegerField(null=True, editable=False)
+    last_post_date = models.DateTimeField(null=True, editable=False)
+    last_post_user = models.CharField(max_length=30, blank=True, editable=False)
+    
+    objects = CategoryManager()
     
     class Meta:
         verbose_name = _('category')
@@ -30,18 +75,22 @@ class Category(models.Model):
     
     def __unicode__(self):
         return self.name
+    
+    def get_last_post(self):
+        # A query per category: lists read the last_post_* columns instead.
+        if self.last_post_id is None:
+            return None
+        try:
+            return Post.objects.get(pk=self.last_post_id)
+        except Post.DoesNotExist:
+            return None
 
 
 class Thread(models.Model):
     user = models.ForeignKey('auth.User', verbose_name=_('user'))
     name = models.CharField(max_length=255, verbose_name=_('subject'))
-
-    # TODO: SignalSlugField allows you to do things when a slug is changed,
-    #       like create a redirect for a previous slug. Is this something
-    #       that should be included in the app? Or should you just be able to
-    #       swap in a proxy model for what you want...
-    # slug = SignalSlugField(max_length=255)
-    slug = models.SlugField(max_length=255)
+    # Old slugs redirect, see snapboard.resolver.
+    slug = SignalSlugField(max_length=255)
     
     category = models.ForeignKey(Category, verbose_name=_('category'))
     private = models.BooleanField(default=False, verbose_name=_('private'))
@@ -50,6 +99,11 @@ class Thread(models.Model):
     date = models.DateTimeField(verbose_name=_('date'), null=True)    
     subscribers = models.ManyToManyField('auth.User', 
         related_name='subscribed_set')
+    # Added by the snapboard_flush_views command, see snapboard.viewcounts.
+    views = models.PositiveIntegerField(default=0, editable=False,
+        verbose_name=_('views'))
+    # Decayed activity, see snapboard.hot.
+    hot = models.FloatField(default=0.0, db_index=True, editable=False)
     
     objects = ThreadManager()
     
@@ -83,7 +137,10 @@ class Thread(models.Model):
         return self.post_set.count()
     
     def get_posts(self):
-        return self.post_set.order_by('date')
+        return self.post_set.with_author_stats().order_by('date')
+    
+    def get_page_count(self):
+        return max(self.get_post_count() - 1, 0) // POSTS_PER_PAGE + 1
     
     def get_last_post(self):
         try:
@@ -112,30 +169,25 @@ class Post(models.Model):
         return u''.join([str(self.user), ': ', str(self.date)])
     
     def invalidate_cache(self):
-        from snapboard.utils import get_prefix_cache_key
+        thread = self.thread
+        extra_paths = []
         
-        prefix = int(time.time())
-
-        cslug = self.thread.category.slug
-        tslug = self.thread.slug
-
-        # Views to clear:
-        paths = [
-            reverse('sb_category_list'),
-            reverse('sb_thread_list'),
-            reverse('sb_category', args=[cslug]),
-            reverse('sb_thread', args=[cslug, tslug])
-        ]
+        from snapboard import warmer
+        if warmer.WARM_CACHE:
+            last_page = thread.get_page_count()
+            if last_page > 1:
+                extra_paths.append('%s?page=%i' % (thread.get_url(), last_page))
         
-        for path in paths:
-            prefix_key = get_prefix_cache_key(path)
-            cache.set(prefix_key, prefix)
+        invalidate_pages([(thread.category.slug, thread.slug)], extra_paths)
         
     def save(self, *args, **kwargs):
         if self.id is None:
             self.date = datetime.now()
-        self.invalidate_cache()                
-        return super(Post, self).save(*args, **kwargs)
+        # Invalidate once the post is saved, so the page isn't cached again
+        # without it.
+        result = super(Post, self).save(*args, **kwargs)
+        self.invalidate_cache()
+        return result
         
     def notify(self):
         from snapboard.utils import renders, bcc_mail
@@ -175,9 +227,201 @@ class UserSettings(models.Model):
     email = models.BooleanField(default=True, 
         help_text=_('Check if you would like to receive email about posts you are watching.'))
     
+    # Shown next to the user's posts, kept up to date by the managers.
+    post_count = models.PositiveIntegerField(default=0, editable=False)
+    thread_count = models.PositiveIntegerField(default=0, editable=False)
+    last_post_at = models.DateTimeField(null=True, editable=False)
+    
+    objects = UserSettingsManager()
+    
     class Meta:
         verbose_name = _('User settings')
         verbose_name_plural = _('User settings')
     
     def __unicode__(self):
         return _('%s\'s preferences') % self.user
+
+
+class APIToken(models.Model):
+    user = models.ForeignKey('auth.User', verbose_name=_('user'),
+        related_name='sb_api_tokens')
+    digest = models.CharField(max_length=64, unique=True, 
+        verbose_name=_('digest'))
+    date = models.DateTimeField(default=datetime.now, verbose_name=_('date'))
+    revoked = models.BooleanField(default=False, verbose_name=_('revoked'))
+    
+    objects = APITokenManager()
+    
+    class Meta:
+        verbose_name = _('API token')
+        verbose_name_plural = _('API tokens')
+    
+    def __unicode__(self):
+        return _('%s\'s API token') % self.user
+
+
+class IPBan(models.Model):
+    address = models.CharField(max_length=43, unique=True, 
+        verbose_name=_('IP address or network'),
+        help_text=_('A single address, or a network such as 10.0.0.0/8.'))
+    reason = models.CharField(max_length=255, blank=True, 
+        verbose_name=_('reason'))
+    date = models.DateTimeField(default=datetime.now, verbose_name=_('date'))
+    
+    class Meta:
+        verbose_name = _('banned IP address')
+        verbose_name_plural = _('banned IP addresses')
+    
+    def __unicode__(self):
+        return self.address
+    
+    def clean(self):
+        from snapboard.bans import parse_network
+        try:
+            parse_network(self.address)
+        except ValueError, e:
+            raise ValidationError(unicode(e))
+
+
+class UserBan(models.Model):
+    user = models.OneToOneField('auth.User', unique=True, 
+        verbose_name=_('user'), related_name='sb_ban')
+    reason = models.CharField(max_length=255, blank=True, 
+        verbose_name=_('reason'))
+    date = models.DateTimeField(default=datetime.now, verbose_name=_('date'))
+    
+    class Meta:
+        verbose_name = _('banned user')
+        verbose_name_plural = _('banned users')
+    
+    def __unicode__(self):
+        return unicode(self.user)
+
+
+def bump_ban_generation(sender, **kwargs):
+    from snapboard.bans import bump_generation
+    bump_generation()
+
+for model in (IPBan, UserBan):
+    post_save.connect(bump_ban_generation, sender=model)
+    post_delete.connect(bump_ban_generation, sender=model)
+
+
+def forget_private_ids(sender, instance, **kwargs):
+    if instance.private:
+        Thread.objects.forget_private_ids([instance.user_id])
+
+post_save.connect(forget_private_ids, sender=Thread)
+
+def uncount(sender, instance, **kwargs):
+    # Bulk deletes refresh the counters with UserSettings.objects.refresh_stats().
+    field = sender is Thread and 'thread_count' or 'post_count'
+    UserSettings.objects.filter(user=instance.user_id, **{'%s__gt' % field: 0}) \
+        .update(**{field: models.F(field) - 1})
+
+for model in (Thread, Post):
+    post_delete.connect(uncount, sender=model)
+
+def update_autocomplete(sender, **kwargs):
+    from snapboard.autocomplete import record_change
+    record_change(sender, **kwargs)
+
+for model in (Thread, User):
+    post_save.connect(update_autocomplete, sender=model)
+    post_delete.connect(update_autocomplete, sender=model)
+
+def record_rename(sender, **kwargs):
+    from snapboard.resolver import record_rename
+    record_rename(sender, **kwargs)
+
+for model in (Category, Thread):
+    fields_updated.connect(record_rename, sender=model)
+
+
+class SlugHistory(models.Model):
+    """
+    A slug a category or thread had before being renamed. URLs using it
+    redirect to the current one.
+    
+    """
+    CATEGORY, THREAD = 'c', 't'
+    
+    kind = models.CharField(max_length=1, choices=((CATEGORY, _('category')), 
+        (THREAD, _('thread'))))
+    slug = models.SlugField(max_length=255, db_index=False)
+    object_id = models.IntegerField()
+    date = models.DateTimeField(default=datetime.now, verbose_name=_('date'))
+    
+    class Meta:
+        unique_together = (('kind', 'slug'),)
+        verbose_name = _('old slug')
+        verbose_name_plural = _('old slugs')
+    
+    def __unicode__(self):
+        return self.slug
+
+
+class ArchivedThread(models.Model):
+    """
+    A thread moved out of the thread table by ``snapboard.archive``. It keeps
+    its id. References are plain integers, as the archive may live in a 
+    separate database.
+    
+    """
+    id = models.IntegerField(primary_key=True)
+    user_id = models.IntegerField()
+    category_id = models.IntegerField()
+    name = models.CharField(max_length=255, verbose_name=_('subject'))
+    slug = models.SlugField(max_length=255)
+    private = models.BooleanField(default=False, verbose_name=_('private'))
+    closed = models.BooleanField(default=False, verbose_name=_('closed'))
+    sticky = models.BooleanField(default=False, verbose_name=_('sticky'))
+    date = models.DateTimeField(verbose_name=_('date'), null=True)
+    views = models.PositiveIntegerField(default=0, verbose_name=_('views'))
+    # Comma separated ids of the users watching the thread.
+    subscriber_ids = models.TextField(blank=True)
+    archived = models.DateTimeField(default=datetime.now, 
+        verbose_name=_('archived'))
+    
+    class Meta:
+        verbose_name = _('archived thread')
+        verbose_name_plural = _('archived threads')
+    
+    def __unicode__(self):
+        return self.name
+    
+    def _get_category(self):
+        if not hasattr(self, '_category_cache'):
+            self._category_cache = Category.objects.get(pk=self.category_id)
+        return self._category_cache
+    category = property(_get_category)
+    
+    def get_posts(self):
+        return ArchivedPost.objects.using(self._state.db) \
+            .filter(thread_id=self.id).order_by('date')
+    
+    def get_url(self):
+        return reverse('sb_thread', args=(self.category.slug, self.slug,))
+    get_absolute_url = get_url
+
+
+class ArchivedPost(models.Model):
+    id = models.IntegerField(primary_key=True)
+    thread_id = models.IntegerField(db_index=True)
+    user_id = models.IntegerField()
+    text = models.TextField(verbose_name=_('text'))
+    date = models.DateTimeField(verbose_name=_('date'), null=True)
+    ip = models.IPAddressField(verbose_name=_('ip address'), blank=True, null=True)
+    
+    class Meta:
+        verbose_name = _('archived post')
+        verbose_name_plural = _('archived posts')
+    
+    def __unicode__(self):
+        return u''.join([str(self.user_id), ': ', str(self.date)])
+    
+    def _get_user(self):
+        if not hasattr(self, '_user_cache'):
+            self._user_cache = User.objects.get(pk=self.user_id)
+        return self._user_cache
+    user = property(_get_user)
@@ -0,0 +1,224 @@
+"""
+Bulk moderation of threads.
+
+Every action runs as one UPDATE, or one DELETE per table, whatever the 
+number of threads, and ends with a single cache invalidation covering all
+the affected categories and threads. No model instance is loaded or saved, 
+so no signals are sent.
+
+"""
+from django.db import connections, router, transaction
+from django.utils.translation import ugettext_lazy as _
+
+from snapboard import autocomplete
+from snapboard.models import Category, Thread, Post, UserSettings, \
+    invalidate_pages
+from snapboard.routers import pin_to_primary
+
+
+# Ids per statement, keeps IN () lists below the database limits.
+BATCH_SIZE = 500
+
+
+def get_slugs(thread_ids):
+    return list(Thread.objects.filter(pk__in=thread_ids)
+        .values_list('category__slug', 'slug'))
+
+def get_category_ids(thread_ids):
+    return set(Thread.objects.filter(pk__in=thread_ids)
+        .values_list('category', flat=True))
+
+def update_threads(thread_ids, **values):
+    '''
+    Sets the given fields on the threads with a single UPDATE and returns 
+    the number of threads updated.
+    
+    '''
+    thread_ids = list(thread_ids)
+    if not thread_ids:
+        return 0
+    slugs = get_slugs(thread_ids)
+    pin_to_primary()
+    count = Thread.objects.filter(pk__in=thread_ids).update(**values)
+    if 'private' in values:
+        autocomplete.indexes.changed('thread', thread_ids)
+        Thread.objects.forget_private_ids(Thread.objects.filter(pk__in=thread_ids)
+            .values_list('user', flat=True))
+    invalidate_pages(slugs)
+    return count
+
+def close_threads(thread_ids, closed=True):
+    return update_threads(thread_ids, closed=closed)
+
+def stick_threads(thread_ids, sticky=True):
+    return update_threads(thread_ids, sticky=sticky)
+
+def make_private(thread_ids, private=True):
+    return update_threads(thread_ids, private=private)
+
+def move_threads(thread_ids, category):
+    thread_ids = list(thread_ids)
+    if not thread_ids:
+        return 0
+    slugs = get_slugs(thread_ids)
+    category_ids = get_category_ids(thread_ids) | set([category.pk])
+    pin_to_primary()
+    count = Thread.objects.filter(pk__in=thread_ids).update(category=category)
+    autocomplete.indexes.changed('thread', thread_ids)
+    Category.objects.refresh_rollups(category_ids)
+    # Both the old and the new category pages change.
+    invalidate_pages(slugs + [(category.slug, tslug) for cslug, tslug in slugs])
+    return count
+
+def delete_in(model, column, ids, using=None):
+    '''
+    Deletes the rows of model whose column is in ids, without loading them. 
+    Returns the number of rows deleted.
+    
+    '''
+    if using is None:
+        using = router.db_for_write(model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    count = 0
+    for offset in range(0, len(ids), BATCH_SIZE):
+        batch = ids[offset:offset + BATCH_SIZE]
+        cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+            qn(model._meta.db_table), qn(column), ', '.join(['%s'] * len(batch))),
+            batch)
+        count += cursor.rowcount
+    
+    if transaction.is_managed(using=using):
+        transaction.set_dirty(using=using)
+    else:
+        transaction.commit_unless_managed(using=using)
+    return count
+
+def get_author_ids(thread_ids):
+    # Users who started or posted in the threads.
+    return set(Post.objects.filter(thread__in=thread_ids)
+        .values_list('user', flat=True).distinct()) | \
+        set(Thread.objects.filter(pk__in=thread_ids).values_list('user', flat=True))
+
+def delete_thread_rows(thread_ids):
+    # Deletes the threads with their posts and subscriptions.
+    author_ids = get_author_ids(thread_ids)
+    subscribers = Thread._meta.get_field('subscribers')
+    delete_in(Post, Post._meta.get_field('thread').column, thread_ids)
+    delete_in(subscribers.rel.through, subscribers.m2m_column_name(), thread_ids)
+    count = delete_in(Thread, Thread._meta.pk.column, thread_ids)
+    autocomplete.indexes.changed('thread', thread_ids)
+    UserSettings.objects.refresh_stats(author_ids)
+    return count
+
+@transaction.commit_on_success
+def delete_threads(thread_ids):
+    thread_ids = list(thread_ids)
+    if not thread_ids:
+        return 0
+    slugs = get_slugs(thread_ids)
+    category_ids = get_category_ids(thread_ids)
+    pin_to_primary()
+    count = delete_thread_rows(thread_ids)
+    Category.objects.refresh_rollups(category_ids)
+    invalidate_pages(slugs)
+    return count
+
+
+# Actions available to the admin and the staff RPC, by name.
+ACTIONS = {
+    'close': (_('Close'), lambda ids: close_threads(ids)),
+    'open': (_('Open'), lambda ids: close_threads(ids, False)),
+    'stick': (_('Stick'), lambda ids: stick_threads(ids)),
+    'unstick': (_('Unstick'), lambda ids: stick_threads(ids, False)),
+    'make_private': (_('Make private'), lambda ids: make_private(ids)),
+    'make_public': (_('Make public'), lambda ids: make_private(ids, False)),
+    'delete': (_('Delete'), delete_threads),
+}
+
+def perform(action, thread_ids, category=None):
+    '''
+    Runs the named action, or moves the threads if action is "move". Returns 
+    the number of threads affected.
+    
+    '''
+    if action == 'move':
+        if category is None:
+            raise ValueError('Moving threads requires a category.')
+        return move_threads(thread_ids, category)
+    try:
+        return ACTIONS[action][1](thread_ids)
+    except KeyError:
+        raise ValueError('Unknown moderation action: %s' % action)
+
+
+def purge(user=None, ip=None, batch_size=BATCH_SIZE, dry_run=False):
+    '''
+    Deletes every post written by user or from ip, and every thread started
+    by user, in batches of batch_size rows committed one at a time. Threads
+    left without posts are deleted; the others get their date recomputed 
+    once. Returns a report dict; with dry_run nothing is deleted.
+    
+    '''
+    from django.db.models import Q, Max, Count
+    
+    if user is None and ip is None:
+        raise ValueError('Purging requires a user or an IP address.')
+    
+    q = Q()
+    if user is not None:
+        q |= Q(user=user)
+    if ip is not None:
+        q |= Q(ip=ip)
+    posts = Post.objects.filter(q)
+    
+    owned_ids = []
+    if user is not None:
+        owned_ids = list(Thread.objects.filter(user=user).values_list('pk', flat=True))
+    
+    # Threads losing posts, with how many posts each of them loses.
+    purged_counts = dict(posts.values_list('thread').annotate(Count('pk')).order_by())
+    touched_ids = set(purged_counts) - set(owned_ids)
+    totals = dict(Post.objects.filter(thread__in=touched_ids)
+        .values_list('thread').annotate(Count('pk')).order_by())
+    emptied_ids = [pk for pk in touched_ids if totals.get(pk, 0) <= purged_counts[pk]]
+    
+    # Other users' posts go with the threads user started.
+    other_posts = Post.objects.filter(thread__in=owned_ids).exclude(q).count()
+    
+    report = {
+        'posts': sum(purged_counts.values()) + other_posts,
+        'threads': len(owned_ids) + len(emptied_ids),
+        'updated_threads': len(touched_ids) - len(emptied_ids),
+    }
+    if dry_run:
+        return report
+    
+    slugs = get_slugs(list(touched_ids) + owned_ids)
+    category_ids = get_category_ids(list(touched_ids) + owned_ids)
+    author_ids = set(posts.values_list('user', flat=True).distinct())
+    for offset in range(0, len(owned_ids), batch_size):
+        delete_thread_rows(owned_ids[offset:offset + batch_size])
+    
+    while True:
+        batch = list(posts.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+        delete_in(Post, Post._meta.pk.column, batch)
+    
+    for offset in range(0, len(emptied_ids), batch_size):
+        delete_thread_rows(emptied_ids[offset:offset + batch_size])
+    
+    remaining = list(touched_ids - set(emptied_ids))
+    for offset in range(0, len(remaining), batch_size):
+        batch = remaining[offset:offset + batch_size]
+        dates = Post.objects.filter(thread__in=batch).values_list('thread') \
+            .annotate(Max('date')).order_by()
+        for pk, date in dates:
+            Thread.objects.filter(pk=pk).update(date=date)
+    
+    Category.objects.refresh_rollups(category_ids)
+    UserSettings.objects.refresh_stats(author_ids)
+    invalidate_pages(slugs)
+    return report
@@ -0,0 +1,131 @@
+"""
+Who's online, without database writes.
+
+PresenceMiddleware adds each visitor to sets kept in the shared cache per
+scope (the whole forum, a category, a thread) and per bucket of
+SB_PRESENCE_BUCKET seconds. A process writes a visitor at most once per
+bucket and scope. Each set is split in SB_PRESENCE_SHARDS keys to keep
+concurrent updates apart, and updates are read-modify-write, so a visitor
+may occasionally be missed until their next bucket: counts are approximate.
+
+Reading the visitors of the last SB_PRESENCE_WINDOW seconds is a single
+get_many() of buckets * shards keys. The sets this process wrote are kept
+locally and merged in, in case the cache lost them.
+
+"""
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from snapboard import stats
+
+
+BUCKET = getattr(settings, 'SB_PRESENCE_BUCKET', 60)
+WINDOW = getattr(settings, 'SB_PRESENCE_WINDOW', 5 * 60)
+SHARDS = getattr(settings, 'SB_PRESENCE_SHARDS', 8)
+
+GLOBAL = 'all'
+
+# {bucket: {key: set of members}}, what this process wrote recently.
+_local = {}
+
+
+def get_bucket(now=None):
+    return int((now or time.time()) // BUCKET)
+
+def get_key(scope, bucket, shard):
+    return 'sb.presence.%s.%i.%i' % (scope, bucket, shard)
+
+def get_shard(member):
+    return zlib.crc32(repr(member)) % SHARDS
+
+def get_scopes(view_kwargs):
+    '''
+    Returns the scopes a request for a view called with view_kwargs counts
+    in.
+
+    '''
+    scopes = [GLOBAL]
+    if 'tslug' in view_kwargs:
+        scopes.append('t.%s' % view_kwargs['tslug'])
+    cslug = view_kwargs.get('cslug') or view_kwargs.get('slug')
+    if cslug:
+        scopes.append('c.%s' % cslug)
+    return scopes
+
+def get_member(request):
+    # Users by id and name, guests by a hash of their address.
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated():
+        return (user.pk, user.username)
+    return ('guest', zlib.crc32(request.META.get('REMOTE_ADDR', '')))
+
+def touch(member, scopes, now=None):
+    '''
+    Records member as present in scopes.
+
+    '''
+    bucket = get_bucket(now)
+    if bucket not in _local:
+        for old in [b for b in _local if b <= bucket - WINDOW // BUCKET - 1]:
+            del _local[old]
+        _local[bucket] = {}
+    local = _local[bucket]
+
+    shard = get_shard(member)
+    keys = [get_key(scope, bucket, shard) for scope in scopes]
+    keys = [key for key in keys if member not in local.get(key, ())]
+    if not keys:
+        return
+
+    found = cache.get_many(keys)
+    updated = {}
+    for key in keys:
+        members = local.setdefault(key, set())
+        members.add(member)
+        updated[key] = set(found.get(key) or ()) | members
+    cache.set_many(updated, WINDOW + BUCKET)
+    stats.incr('presence.writes')
+
+def get_members(scope, window=WINDOW, now=None):
+    '''
+    Returns the set of members seen in scope in the last window seconds.
+
+    '''
+    bucket = get_bucket(now)
+    keys = [get_key(scope, b, shard)
+        for b in range(bucket - window // BUCKET, bucket + 1)
+        for shard in range(SHARDS)]
+    found = cache.get_many(keys)
+    members = set()
+    for key in keys:
+        members.update(found.get(key) or ())
+        for local in _local.values():
+            members.update(local.get(key, ()))
+    return members
+
+def get_online(scope=GLOBAL, window=WINDOW, now=None):
+    '''
+    Returns a dict with the sorted names of the users seen in scope in the
+    last window seconds, the number of guests and the total count.
+
+    '''
+    members = get_members(scope, window, now)
+    users = sorted([name for pk, name in members if pk != 'guest'])
+    return {
+        'users': users,
+        'guests': len(members) - len(users),
+        'count': len(members),
+    }
+
+def get_scope(obj):
+    # The scope of a Thread or Category, or the whole forum for None.
+    from snapboard.models import Category, Thread
+
+    if isinstance(obj, Thread):
+        return 't.%s' % obj.slug
+    if isinstance(obj, Category):
+        return 'c.%s' % obj.slug
+    return GLOBAL
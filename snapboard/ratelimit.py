@@ -0,0 +1,104 @@
+"""
+Token bucket rate limiting of write endpoints, per user and per IP address.
+
+Buckets are kept in the shared cache so that limits hold across processes, 
+or in process when the cache is the dummy backend or fails. Limits are set 
+per endpoint in SB_RATE_LIMITS as (tokens per second, burst size); staff 
+users aren't limited.
+
+"""
+import math
+import time
+try:
+    from functools import wraps
+except ImportError:
+    from django.utils.functional import wraps  # Python 2.4 fallback.
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.dummy import CacheClass as DummyCache
+from django.http import HttpResponse
+from django.utils.translation import ugettext as _
+
+from snapboard import stats
+from snapboard.localcache import LRUCache
+
+
+RATE_LIMITS = {
+    'preview': (1.0, 10),
+    'post': (1.0 / 10, 5),
+    'new_thread': (1.0 / 60, 3),
+}
+RATE_LIMITS.update(getattr(settings, 'SB_RATE_LIMITS', {}))
+
+_local_buckets = LRUCache(max_entries=10000)
+
+
+def get_bucket_keys(request, endpoint):
+    keys = ['sb.rl.%s.ip.%s' % (endpoint, request.META.get('REMOTE_ADDR'))]
+    if request.user.is_authenticated():
+        keys.append('sb.rl.%s.u.%i' % (endpoint, request.user.id))
+    return keys
+
+def take(keys, rate, burst, now=None):
+    '''
+    Takes a token from each bucket. Returns 0 if all of them had one, or the
+    number of seconds until they will.
+    
+    '''
+    if now is None:
+        now = time.time()
+    timeout = int(burst / rate) + 1
+    shared = not isinstance(cache, DummyCache)
+    buckets = {}
+    if shared:
+        try:
+            buckets = cache.get_many(keys)
+        except Exception:
+            shared = False
+    if not shared:
+        buckets = dict((key, _local_buckets.get(key)) for key in keys)
+    
+    wait = 0
+    updated = {}
+    for key in keys:
+        tokens, stamp = buckets.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - stamp) * rate)
+        if tokens < 1:
+            wait = max(wait, (1 - tokens) / rate)
+        updated[key] = tokens
+    if wait:
+        return wait
+    
+    updated = dict((key, (tokens - 1, now)) for key, tokens in updated.items())
+    if shared:
+        try:
+            cache.set_many(updated, timeout)
+            return 0
+        except Exception:
+            pass
+    for key, bucket in updated.items():
+        _local_buckets.set(key, bucket, timeout)
+    return 0
+
+def rate_limit(endpoint, methods=('POST',)):
+    '''
+    Answers requests to the decorated view with 429 Too Many Requests when 
+    the client is over the limits of endpoint.
+    
+    '''
+    def decorator(view):
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods and endpoint in RATE_LIMITS \
+                    and not request.user.is_staff:
+                rate, burst = RATE_LIMITS[endpoint]
+                wait = take(get_bucket_keys(request, endpoint), rate, burst)
+                if wait:
+                    stats.incr('ratelimit.%s' % endpoint)
+                    response = HttpResponse(_('Too many requests, please slow down.'),
+                        status=429, mimetype='text/plain')
+                    response['Retry-After'] = str(int(math.ceil(wait)))
+                    return response
+            return view(request, *args, **kwargs)
+        return wraps(view)(wrapper)
+    return decorator
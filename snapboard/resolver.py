@@ -0,0 +1,132 @@
+"""
+Thread URLs to thread ids, and redirects from renamed slugs.
+
+The thread view maps (category slug, thread slug) to a thread id through
+the tiered cache and loads the thread by primary key, instead of joining
+on the category slug on every request. The loaded thread's slugs are
+checked, so an entry made stale by a bulk move or a deletion only costs a
+second lookup.
+
+When a category or thread slug changes, its old slug is recorded in
+SlugHistory. URLs using old slugs, or the old category of a moved thread,
+resolve to the current URL, also cached, and are answered with a 301.
+
+"""
+import urllib
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+
+from snapboard.localcache import tiered
+from snapboard.models import Category, Thread, SlugHistory, invalidate_pages
+
+
+TIMEOUT = getattr(settings, 'SB_SLUG_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def get_key(cslug, tslug=None):
+    key = 'sb.slug.%s' % urllib.quote(cslug.encode('utf-8'))
+    if tslug is not None:
+        key += '.%s' % urllib.quote(tslug.encode('utf-8'))
+    return key
+
+def forget(cslug, tslug=None):
+    tiered.delete(get_key(cslug, tslug))
+
+def find_thread(cslug, tslug):
+    # The thread id, the URL the thread has moved to, or None.
+    threads = Thread.objects.values_list('pk', 'category__slug', 'slug')
+    rows = list(threads.filter(slug=tslug))
+    for pk, category_slug, slug in rows:
+        if category_slug == cslug:
+            return pk
+    if not rows:
+        ids = SlugHistory.objects.filter(kind=SlugHistory.THREAD, slug=tslug) \
+            .values_list('object_id', flat=True)
+        rows = list(threads.filter(pk__in=list(ids)))
+    if rows:
+        pk, category_slug, slug = rows[0]
+        return reverse('sb_thread', args=(category_slug, slug))
+    return None
+
+def resolve_thread(cslug, tslug):
+    '''
+    Returns (thread id, None) for the thread at cslug/tslug, (None, URL) if
+    it is now at URL, or (None, None) if there is no such thread.
+
+    '''
+    key = get_key(cslug, tslug)
+    value = tiered.get(key)
+    if value is None:
+        value = find_thread(cslug, tslug)
+        if value is None:
+            return None, None
+        tiered.set(key, value, TIMEOUT)
+    if isinstance(value, basestring):
+        return None, value
+    return value, None
+
+def get_thread(cslug, tslug, retry=True):
+    '''
+    Returns (thread, None) for the thread at cslug/tslug, with its category,
+    (None, URL) if it is now at URL, or (None, None).
+
+    '''
+    thread_id, url = resolve_thread(cslug, tslug)
+    if thread_id is None:
+        return None, url
+    thread = list(Thread.objects.select_related('category').filter(pk=thread_id))
+    if thread and (thread[0].category.slug, thread[0].slug) == (cslug, tslug):
+        return thread[0], None
+    # Moved, renamed or deleted since it was cached.
+    forget(cslug, tslug)
+    if retry:
+        return get_thread(cslug, tslug, False)
+    return None, None
+
+def get_category_redirect(slug):
+    '''
+    Returns the URL of the category that had slug, or None.
+
+    '''
+    key = get_key(slug)
+    url = tiered.get(key)
+    if url is None:
+        ids = SlugHistory.objects.filter(kind=SlugHistory.CATEGORY, slug=slug) \
+            .values_list('object_id', flat=True)
+        slugs = Category.objects.filter(pk__in=list(ids)) \
+            .values_list('slug', flat=True)[:1]
+        if not slugs:
+            return None
+        url = reverse('sb_category', args=(slugs[0],))
+        tiered.set(key, url, TIMEOUT)
+    return url
+
+
+def record_rename(sender, instance, state, **kwargs):
+    '''
+    Signal handler recording the old slug of a renamed category or thread.
+
+    '''
+    old = state.get('slug')
+    if not old or old == instance.slug:
+        return
+    kind = sender is Category and SlugHistory.CATEGORY or SlugHistory.THREAD
+    # The new slug may be an old one coming back.
+    SlugHistory.objects.filter(kind=kind, slug__in=[old, instance.slug]).delete()
+    SlugHistory.objects.create(kind=kind, slug=old, object_id=instance.pk)
+
+    # Cached thread ids are checked when used, forget the redirects.
+    if kind == SlugHistory.CATEGORY:
+        forget(old)
+        forget(instance.slug)
+        tslugs = Thread.objects.filter(category=instance) \
+            .values_list('slug', flat=True)
+        # The new URLs too, closed threads are frozen again under them.
+        invalidate_pages([(old, None)] + [(cslug, tslug) for tslug in tslugs
+            for cslug in (old, instance.slug)])
+    else:
+        cslug = instance.category.slug
+        forget(cslug, old)
+        forget(cslug, instance.slug)
+        invalidate_pages([(cslug, old), (cslug, instance.slug)])
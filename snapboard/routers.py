@@ -0,0 +1,95 @@
+"""
+Database router sending snapboard reads to replicas.
+
+Add ``'snapboard.routers.ReplicaRouter'`` to DATABASE_ROUTERS, list the
+replica aliases in SB_DATABASE_REPLICAS and add 
+``snapboard.middleware.replica.ReplicaPinningMiddleware`` to the middleware.
+Writes go to SB_DATABASE_PRIMARY. For SB_REPLICA_PIN_SECONDS after a user 
+posts, their reads stay on the primary so they never miss their own post on
+a lagging replica.
+
+Pins last until the end of the request. Code writing outside of requests,
+such as management commands, should call unpin() when done.
+
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.core.signals import request_finished
+
+
+PRIMARY = getattr(settings, 'SB_DATABASE_PRIMARY', 'default')
+REPLICAS = tuple(getattr(settings, 'SB_DATABASE_REPLICAS', ()))
+PIN_SECONDS = getattr(settings, 'SB_REPLICA_PIN_SECONDS', 5)
+PIN_COOKIE = 'sb_primary'
+
+_local = threading.local()
+
+
+def pin_to_primary(wrote=True):
+    '''
+    Sends the reads of the current request to the primary. With wrote=True,
+    the following requests of the same client are pinned too.
+    
+    '''
+    _local.pinned = True
+    _local.wrote = getattr(_local, 'wrote', False) or wrote
+
+def unpin():
+    _local.pinned = _local.wrote = False
+
+def unpin_on_finish(sender, **kwargs):
+    unpin()
+
+request_finished.connect(unpin_on_finish)
+
+def is_pinned():
+    return getattr(_local, 'pinned', False)
+
+def has_written():
+    return getattr(_local, 'wrote', False)
+
+
+class ReplicaRouter(object):
+    def get_archive_db(self, model):
+        # The archive's own database, if it has one and model is archived.
+        from snapboard.models import ARCHIVE_DATABASE, ArchivedThread, ArchivedPost
+        if model in (ArchivedThread, ArchivedPost):
+            return ARCHIVE_DATABASE
+        return None
+    
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'snapboard':
+            return None
+        archive_db = self.get_archive_db(model)
+        if archive_db:
+            return archive_db
+        if not REPLICAS or is_pinned():
+            return PRIMARY
+        return random.choice(REPLICAS)
+    
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != 'snapboard':
+            return None
+        archive_db = self.get_archive_db(model)
+        if archive_db:
+            return archive_db
+        return PRIMARY
+    
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so their objects can be related.
+        databases = (PRIMARY,) + REPLICAS
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+    
+    def allow_syncdb(self, db, model):
+        if model._meta.app_label != 'snapboard':
+            return None
+        archive_db = self.get_archive_db(model)
+        if archive_db:
+            return db == archive_db
+        if db in REPLICAS:
+            return False
+        return None
@@ -0,0 +1,107 @@
+"""
+Sitemaps of the public threads.
+
+Thread ids are split in ranges of SB_SITEMAP_CHUNK, 50,000 by default, the
+most URLs a sitemap may hold; the sitemap index lists the ranges holding
+public threads. A sitemap is generated by reading its range in batches of
+rows in id order, each row holding the thread and category slugs and the
+thread date, and is streamed as it goes. Thread URLs are built from a
+single reverse().
+
+The snapboard_sitemap command writes the same sitemaps gzipped to disk,
+for the web server to serve directly.
+
+"""
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
+from django.db.models import Max
+from django.utils.html import escape
+
+from snapboard.models import Thread
+
+
+CHUNK = getattr(settings, 'SB_SITEMAP_CHUNK', 50000)
+# Rows read per query.
+BATCH_SIZE = 5000
+
+INDEX_HEAD = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+    '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+INDEX_ENTRY = '<sitemap><loc>%s</loc><lastmod>%s</lastmod></sitemap>\n'
+INDEX_TAIL = '</sitemapindex>\n'
+
+URLSET_HEAD = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+    '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+URLSET_ENTRY = '<url><loc>%s</loc><lastmod>%s</lastmod></url>\n'
+URLSET_TAIL = '</urlset>\n'
+
+
+def get_base_url(request=None):
+    base = getattr(settings, 'SB_SITEMAP_BASE_URL', None)
+    if base is None:
+        if request is not None:
+            base = 'http://%s' % request.get_host()
+        else:
+            base = 'http://%s' % Site.objects.get_current().domain
+    return base.rstrip('/')
+
+def get_threads():
+    return Thread.objects.filter(private=False)
+
+def get_chunks():
+    '''
+    Returns (chunk, lastmod) pairs for the chunks holding public threads.
+
+    '''
+    last = get_threads().aggregate(Max('pk'))['pk__max']
+    if last is None:
+        return []
+    chunks = []
+    for chunk in range(last // CHUNK + 1):
+        lastmod = get_threads().filter(pk__gte=chunk * CHUNK,
+            pk__lt=(chunk + 1) * CHUNK).aggregate(Max('date'))['date__max']
+        if lastmod is not None:
+            chunks.append((chunk, lastmod))
+    return chunks
+
+def format_date(date):
+    return date and date.strftime('%Y-%m-%d') or ''
+
+def generate_index(base_url, location=None):
+    '''
+    Yields the sitemap index, listing the sitemaps at location(chunk), the
+    sitemap view by default.
+
+    '''
+    if location is None:
+        location = lambda chunk: reverse('sb_sitemap', args=(chunk,))
+    yield INDEX_HEAD
+    for chunk, lastmod in get_chunks():
+        yield INDEX_ENTRY % (escape(base_url + location(chunk)),
+            format_date(lastmod))
+    yield INDEX_TAIL
+
+def get_url_template(base_url):
+    # The thread URL with %(c)s and %(t)s standing for the slugs.
+    url = escape(base_url + reverse('sb_thread', args=('SBCSLUG', 'SBTSLUG')))
+    return url.replace('%', '%%').replace('SBCSLUG', '%(c)s', 1) \
+        .replace('SBTSLUG', '%(t)s', 1)
+
+def generate(chunk, base_url):
+    '''
+    Yields the sitemap of the public threads of chunk, in pieces.
+
+    '''
+    template = get_url_template(base_url)
+    threads = get_threads().filter(pk__lt=(chunk + 1) * CHUNK) \
+        .order_by('pk').values_list('pk', 'category__slug', 'slug', 'date')
+    after = chunk * CHUNK - 1
+    yield URLSET_HEAD
+    while True:
+        rows = list(threads.filter(pk__gt=after)[:BATCH_SIZE])
+        if not rows:
+            break
+        yield ''.join([URLSET_ENTRY % (template % {'c': cslug, 't': tslug},
+            format_date(date)) for pk, cslug, tslug, date in rows])
+        after = rows[-1][0]
+    yield URLSET_TAIL
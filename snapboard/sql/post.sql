@@ -0,0 +1,10 @@
+-- Composite indexes matching Thread.get_posts() and Thread.get_last_post().
+-- Run by syncdb for new tables; for existing ones, apply the output of 
+-- "manage.py sqlcustom snapboard".
+
+-- Posts of a thread in date order, and its last post.
+CREATE INDEX snapboard_post_thread_date ON snapboard_post (thread_id, date);
+-- Latest posts and feeds.
+CREATE INDEX snapboard_post_date ON snapboard_post (date);
+-- Purges and bans by address.
+CREATE INDEX snapboard_post_ip ON snapboard_post (ip);
@@ -0,0 +1,15 @@
+-- Composite indexes matching ThreadManager queries. Run by syncdb for new
+-- tables; for existing ones, apply the output of "manage.py sqlcustom snapboard".
+
+-- Category pages: category, visibility, then -sticky, -date ordering.
+CREATE INDEX snapboard_thread_category_listing ON snapboard_thread (category_id, private, sticky, date);
+-- Category pages for staff, who see private threads too.
+CREATE INDEX snapboard_thread_category_staff ON snapboard_thread (category_id, sticky, date);
+-- Latest threads, for everyone and for staff.
+CREATE INDEX snapboard_thread_latest ON snapboard_thread (private, date);
+CREATE INDEX snapboard_thread_date ON snapboard_thread (date);
+-- Favorites and a user's own threads, newest first.
+CREATE INDEX snapboard_thread_user_date ON snapboard_thread (user_id, date);
+-- Hot threads, public ones and per category.
+CREATE INDEX snapboard_thread_public_hot ON snapboard_thread (private, hot);
+CREATE INDEX snapboard_thread_category_hot ON snapboard_thread (category_id, hot);
@@ -0,0 +1,70 @@
+"""
+Counters for cache and worker behaviour.
+
+Increments are buffered in process and added to the shared cache at most 
+every SB_STATS_FLUSH_INTERVAL seconds, so counting never costs a cache round
+trip on the request path. Totals are read back with ``get_stats()`` or the
+``snapboard_stats`` management command.
+
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+FLUSH_INTERVAL = getattr(settings, 'SB_STATS_FLUSH_INTERVAL', 10)
+
+NAMES_KEY = 'sb.stats.names'
+
+_pending = {}
+_known = set()
+_last_flush = [time.time()]
+
+
+def get_counter_key(name):
+    return 'sb.stats.%s' % name
+
+def incr(name, delta=1):
+    _pending[name] = _pending.get(name, 0) + delta
+    if time.time() - _last_flush[0] > FLUSH_INTERVAL:
+        flush()
+
+def flush():
+    _last_flush[0] = time.time()
+    new_names = []
+    for name in _pending.keys():
+        delta = _pending.pop(name, 0)
+        if name not in _known:
+            _known.add(name)
+            new_names.append(name)
+        if not delta:
+            continue
+        key = get_counter_key(name)
+        cache.add(key, 0)
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # Evicted between add() and incr().
+            cache.set(key, delta)
+    
+    if new_names:
+        names = set(cache.get(NAMES_KEY) or [])
+        if not names.issuperset(new_names):
+            names.update(new_names)
+            cache.set(NAMES_KEY, sorted(names))
+
+def get_stats():
+    '''
+    Returns a dict of counter totals, including this process' pending 
+    increments.
+    
+    '''
+    names = set(cache.get(NAMES_KEY) or []) | set(_pending)
+    keys = dict((get_counter_key(name), name) for name in names)
+    totals = dict((name, 0) for name in names)
+    for key, value in cache.get_many(keys.keys()).items():
+        totals[keys[key]] = value
+    for name, delta in _pending.items():
+        totals[name] += delta
+    return totals
@@ -0,0 +1,136 @@
+"""
+Whole threads on one page, or exported as text or JSON, streamed.
+
+Posts are read in keyset chunks of SB_STREAM_CHUNK posts, one query per
+chunk, so neither the database driver nor the worker ever holds more than a
+chunk, whatever the length of the thread. The page is the thread template
+rendered once with a marker in place of the posts; the posts are rendered
+one at a time with snapboard/post.html between the two halves.
+
+The responses are final: CachedTemplateMiddleware neither caches nor
+renders them again. The halves of the page get their second pass here.
+
+Django sends request_finished, closing the database connections, before
+the response is iterated: the connections opened by the iteration are
+closed when the server closes the response, after the last chunk.
+
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_connection, transaction
+from django.http import HttpResponse
+from django.template import RequestContext, Template
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+from snapboard.json import dumps
+from snapboard.managers import keyset_filter
+
+
+CHUNK = getattr(settings, 'SB_STREAM_CHUNK', 200)
+
+MARKER = '<!--sb:posts-->'
+
+
+def iter_posts(thread, chunk=CHUNK):
+    '''
+    Yields the posts of thread, a Thread or an ArchivedThread, by date.
+
+    '''
+    ordering = ['date', 'pk']
+    qs = thread.get_posts().order_by(*ordering)
+    posts = list(qs[:chunk])
+    while posts:
+        load_users(posts)
+        for post in posts:
+            yield post
+        if len(posts) < chunk:
+            break
+        last = posts[-1]
+        posts = list(keyset_filter(qs, ordering, (last.date, last.pk))[:chunk])
+
+def load_users(posts):
+    # Archived posts only have the user id, fetch the chunk's authors at once.
+    missing = [post for post in posts if not hasattr(post, '_user_cache')]
+    if not missing:
+        return
+    users = User.objects.in_bulk(set([post.user_id for post in missing]))
+    for post in missing:
+        if post.user_id in users:
+            post._user_cache = users[post.user_id]
+
+def second_pass(content, context):
+    # What CachedTemplateMiddleware would do to the page.
+    if '{%' in content or '{{' in content:
+        return Template(content).render(context)
+    return content
+
+class StreamingResponse(HttpResponse):
+    """
+    A final response closing the database connections once the server is
+    done with it.
+    
+    """
+    sb_final = True
+    
+    def close(self):
+        super(StreamingResponse, self).close()
+        # Read within a transaction, by a test or buffering middleware.
+        if not transaction.is_managed():
+            close_connection()
+
+def stream_page(request, template, ctx):
+    '''
+    Returns a response streaming template, rendered with ctx, with the posts
+    of ctx['thread'] where the template outputs {{ posts }}.
+
+    '''
+    context = RequestContext(request, ctx)
+    context['posts'] = mark_safe(MARKER)
+    page = render_to_string(template, context_instance=context)
+    head, tail = (page.split(MARKER, 1) + [''])[:2]
+
+    def content():
+        yield second_pass(head, RequestContext(request))
+        post_template = get_template('snapboard/post.html')
+        for post in iter_posts(ctx['thread']):
+            context.push()
+            context['post'] = post
+            yield post_template.render(context)
+            context.pop()
+        yield second_pass(tail, RequestContext(request))
+    return StreamingResponse(content())
+
+def export_text(thread):
+    yield u'%s\n%s\n\n' % (thread.name, u'=' * len(thread.name))
+    for post in iter_posts(thread):
+        yield u'%s, %s\n\n%s\n\n' % (post.user.username, post.date, post.text)
+
+def export_json(thread):
+    yield '{"thread": %s, "posts": [' % dumps({
+        'id': thread.pk,
+        'name': thread.name,
+        'url': thread.get_url(),
+    })
+    separator = ''
+    for post in iter_posts(thread):
+        yield separator + dumps({
+            'id': post.pk,
+            'user': post.user.username,
+            'date': post.date,
+            'text': post.text,
+        })
+        separator = ', '
+    yield ']}'
+
+EXPORTS = {
+    'txt': (export_text, 'text/plain; charset=utf-8'),
+    'json': (export_json, 'application/json'),
+}
+
+def stream_export(thread, format):
+    export, mimetype = EXPORTS[format]
+    response = StreamingResponse(export(thread), mimetype=mimetype)
+    response['Content-Disposition'] = 'inline; filename=%s.%s' % (thread.slug,
+        format)
+    return response
@@ -2,6 +2,8 @@
 from django import template
 from django.conf import settings
 
+from snapboard.bundles import get_urls
+from snapboard import presence
 from snapboard.models import Post
 
 
@@ -81,6 +83,67 @@ def get_unique_latest_posts(parser, token):
 
 
 
+class GetOnlineNode(template.Node):
+    def __init__(self, obj, var_name):
+        self.obj = obj and template.Variable(obj)
+        self.var_name = var_name
+    
+    def render(self, context):
+        obj = self.obj and self.obj.resolve(context) or None
+        context[self.var_name] = presence.get_online(presence.get_scope(obj))
+        return ''
+
+@register.tag
+def get_online(parser, token):
+    '''
+    Sets a variable to the users seen recently on the forum, or in a thread or
+    category: a dict with the sorted "users" names, the number of "guests" 
+    and the total "count".
+    
+    usage:
+        {% get_online as online %}
+        {% get_online for thread as online %}
+    
+    '''
+    bits = token.split_contents()
+    if len(bits) == 3 and bits[1] == 'as':
+        return GetOnlineNode(None, bits[2])
+    if len(bits) == 5 and bits[1] == 'for' and bits[3] == 'as':
+        return GetOnlineNode(bits[2], bits[4])
+    raise template.TemplateSyntaxError(
+        '%r expects "[for object] as variable".' % bits[0])
+
+
+class BundleNode(template.Node):
+    def __init__(self, name):
+        self.name = name
+    
+    def render(self, context):
+        if self.name.endswith('.css'):
+            tag = '<link type="text/css" rel="stylesheet" href="%s" />'
+        else:
+            tag = '<script type="text/javascript" src="%s"></script>'
+        return '\n'.join([tag % url for url in get_urls(self.name)])
+
+@register.tag
+def sb_bundle(parser, token):
+    '''
+    Links to a static bundle built by the snapboard_bundle command, or to the
+    files it's made of if it wasn't built.
+    
+    usage:
+        {% sb_bundle "snapboard.css" %}
+    
+    '''
+    try:
+        tag_name, name = token.split_contents()
+    except ValueError:
+        raise template.TemplateSyntaxError('%r takes a bundle name.' % 
+            token.contents.split()[0])
+    return BundleNode(name.strip('"\''))
+
+
+
 # Copyright 2009, EveryBlock
 # This code is released under the GPL.
 @register.tag
@@ -1 +1 @@
-from tests import ViewsTest, ThreadTest, UtilsTest, APITest
\ No newline at end of file
+from tests import ViewsTest, CacheTest, ViewCountTest, HotTest, PresenceTest, SitemapTest, FreezerTest, BanTest, ModerationTest, ArchiveTest, RouterTest, AutocompleteTest, RateLimitTest, ThreadTest, UtilsTest, APITest
\ No newline at end of file
@@ -4,6 +4,7 @@ import base64
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core import mail
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 
@@ -71,6 +72,13 @@ class ViewsTest(TestCase):
         uri = reverse("sb_category_list")
         r = self.client.get(uri)
         self.assertTemplateUsed(r, "snapboard/category_list.html")
+        smodels.Category.objects.refresh_rollups()
+        cache.clear()
+        category = list(self.client.get(uri).context["categories"])[0]
+        post = smodels.Post.objects.filter(thread__category=category) \
+            .order_by("-date")[0]
+        self.assertEquals((category.last_post_date, category.last_post_user), 
+            (post.date, post.user.username))
 
     def test_category(self):
         uri = reverse("sb_category", kwargs={"slug": "category"})
@@ -145,13 +153,678 @@ class ViewsTest(TestCase):
         self.assertEquals(new_thread.slug, "thread-1")
         
 
+class CacheTest(TestCase):
+    urls = "snapboard.tests.test_urls"
+    fixtures = ["test_data.json"]
+    
+    def tearDown(self):
+        cache.clear()
+    
+    def test_stale_while_locked(self):
+        from snapboard.utils import get_prefix_cache_key, get_lock_cache_key, \
+            new_cache_prefix
+        
+        uri = reverse("sb_category_list")
+        cache.set(get_prefix_cache_key(uri), 1)
+        r = self.client.get(uri)
+        self.assertFalse(r.has_header("Warning"))
+        
+        # Invalidate the page while another worker is regenerating it.
+        prefix = new_cache_prefix()
+        cache.set(get_prefix_cache_key(uri), prefix)
+        cache.add(get_lock_cache_key("%s.%s" % (prefix, uri)), 1)
+        r = self.client.get(uri)
+        self.assertTrue(r.has_header("Warning"))
+        self.assertEquals(r.status_code, 200)
+        
+
+    def test_packed_response(self):
+        from django.http import HttpRequest, HttpResponse
+        from snapboard.utils import pack_response, unpack_response
+        
+        record = pack_response(HttpResponse("<p>page</p>" * 100))
+        request = HttpRequest()
+        request.META["HTTP_ACCEPT_ENCODING"] = "gzip"
+        r = unpack_response(record, request)
+        self.assertEquals(r["Content-Encoding"], "gzip")
+        self.assertTrue(len(r.content) < 100)
+        
+        # Clients that don't accept gzip get the page decompressed.
+        r = unpack_response(record, HttpRequest())
+        self.assertEquals(r.content, "<p>page</p>" * 100)
+        
+
+class ViewCountTest(TestCase):
+    fixtures = ["test_data.json"]
+    
+    def tearDown(self):
+        cache.clear()
+    
+    def test_flush(self):
+        import time
+        from snapboard import viewcounts
+        
+        thread = smodels.Thread.objects.get(pk=1)
+        for i in range(3):
+            viewcounts.count_view(thread.slug)
+        viewcounts.count_view("no-such-thread")
+        # Not flushed before the epoch is over.
+        self.assertEquals(viewcounts.flush(), 0)
+        
+        later = time.time() + 3 * viewcounts.EPOCH
+        self.assertEquals(viewcounts.flush(later), 3)
+        self.assertEquals(smodels.Thread.objects.get(pk=1).views, 3)
+        self.assertEquals(viewcounts.flush(later), 0)
+
+
+class HotTest(TestCase):
+    urls = "snapboard.tests.test_urls"
+    fixtures = ["test_data.json"]
+    
+    def tearDown(self):
+        from snapboard.localcache import tiered
+        cache.clear()
+        tiered.local.clear()
+    
+    def test_scores(self):
+        from snapboard import hot
+        
+        now = 1300000000
+        day = hot.HALF_LIFE
+        old = hot.add_event(hot.add_event(0, 1.0, now - day), 1.0, now - day)
+        new = hot.add_event(0, 1.0, now)
+        # Two posts a half-life ago weigh as much as one now.
+        self.assertAlmostEquals(old, new)
+        self.assertAlmostEquals(hot.get_activity(new, now), 1.0)
+        
+        thread = smodels.Thread.objects.get(pk=1)
+        hot.record_post(thread, now)
+        hot.record_post(smodels.Thread.objects.get(pk=1), now)
+        self.assertAlmostEquals(smodels.Thread.objects.get(pk=1).hot, 
+            hot.add_event(new, 1.0, now))
+    
+    def test_hot_list(self):
+        user = User.objects.get(username="jiveturkey")
+        other = User.objects.get(username="blackdynamite")
+        quiet = smodels.Thread.objects.create_thread(user=user, category_id=1,
+            name="quiet")
+        busy = smodels.Thread.objects.create_thread(user=user, category_id=1,
+            name="busy")
+        secret = smodels.Thread.objects.create_thread(user=other, 
+            category_id=1, name="secret", private=True)
+        smodels.Post.objects.create_and_notify(quiet, user, text="a")
+        self.client.get(reverse("sb_hot_list"))
+        for thread in (busy, busy, secret, secret, secret):
+            smodels.Post.objects.create_and_notify(thread, user, text="a")
+        
+        r = self.client.get(reverse("sb_hot_list"))
+        self.assertTemplateUsed(r, "snapboard/hot_list.html")
+        # The fixture's thread has no recent posts.
+        idle = smodels.Thread.objects.get(pk=1)
+        self.assertEquals(list(r.context["threads"]), [busy, quiet, idle])
+        self.client.login(username="blackdynamite", password="!")
+        r = self.client.get(reverse("sb_category_hot_list", args=("category",)))
+        self.assertEquals(r.context["category"].slug, "category")
+        self.assertEquals(list(r.context["threads"]), [secret, busy, quiet, 
+            idle])
+
+
+class PresenceTest(TestCase):
+    def tearDown(self):
+        from snapboard import presence
+        cache.clear()
+        presence._local.clear()
+    
+    def test_online(self):
+        from django.template import Template, Context
+        from snapboard import presence
+        
+        now = 1300000000
+        thread = smodels.Thread(slug="thread")
+        for member in [(1, "test"), (2, "jiveturkey"), ("guest", 123)]:
+            presence.touch(member, presence.get_scopes({"cslug": "category",
+                "tslug": "thread"}), now)
+        presence.touch((3, "blackdynamite"), [presence.GLOBAL], now - 60)
+        
+        online = presence.get_online(presence.get_scope(thread), now=now)
+        self.assertEquals(online["users"], ["jiveturkey", "test"])
+        self.assertEquals(online["guests"], 1)
+        self.assertEquals(presence.get_online(now=now)["count"], 4)
+        # Out of the window.
+        self.assertEquals(presence.get_online(now=now + presence.WINDOW + 
+            presence.BUCKET)["count"], 0)
+        
+        presence.touch((1, "test"), [presence.GLOBAL])
+        t = Template("{% load sb_tags %}{% get_online as online %}"
+            "{{ online.users|join:',' }}")
+        self.assertEquals(t.render(Context()), "test")
+
+
+class SitemapTest(TestCase):
+    urls = "snapboard.tests.test_urls"
+    fixtures = ["test_data.json"]
+    
+    def test_sitemaps(self):
+        import gzip, shutil, tempfile
+        from django.core.management import call_command
+        
+        # The content is generated as it is read, read it once.
+        r = self.client.get(reverse("sb_sitemap_index"))
+        self.assertEquals(r["Content-Type"], "application/xml")
+        self.assertTrue(reverse("sb_sitemap", args=(0,)) in r.content)
+        
+        content = self.client.get(reverse("sb_sitemap", args=(0,))).content
+        thread = smodels.Thread.objects.get(pk=1)
+        self.assertTrue(thread.get_absolute_url() in content)
+        self.assertTrue(thread.date.strftime("%Y-%m-%d") in content)
+        self.assertEquals(content.count("<url>"), 
+            smodels.Thread.objects.filter(private=False).count())
+        
+        root = tempfile.mkdtemp()
+        try:
+            call_command("snapboard_sitemap", output=root)
+            f = gzip.open(os.path.join(root, "sitemap-0.xml.gz"))
+            # Written with the Site domain instead of the request host.
+            self.assertEquals(f.read(), content.replace("http://testserver", 
+                "http://example.com"))
+        finally:
+            shutil.rmtree(root)
+
+
+class FreezerTest(TestCase):
+    urls = "snapboard.tests.test_urls"
+    fixtures = ["test_data.json"]
+    
+    def setUp(self):
+        import tempfile
+        from snapboard import freezer
+        self.old_root = freezer.FREEZE_ROOT
+        freezer.FREEZE_ROOT = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        import shutil
+        from snapboard import freezer
+        shutil.rmtree(freezer.FREEZE_ROOT)
+        freezer.FREEZE_ROOT = self.old_root
+        cache.clear()
+    
+    def test_freeze(self):
+        import time
+        from snapboard import freezer, moderation, viewcounts
+        
+        thread = smodels.Thread.objects.get(pk=1)
+        path = freezer.get_path(thread.category.slug, thread.slug)
+        freezer.freeze()
+        self.assertFalse(os.path.exists(path))
+        
+        moderation.close_threads([thread.pk])
+        freezer.freeze()
+        self.assertTrue(os.path.exists(path + ".gz"))
+        # Freezing isn't viewing.
+        self.assertEquals(viewcounts.flush(time.time() + 3 * viewcounts.EPOCH), 0)
+        f = open(path, "a")
+        f.write("<!-- frozen -->")
+        f.close()
+        # Served to anonymous users only, once the page cache misses.
+        cache.clear()
+        self.assertTrue("frozen" in self.client.get(thread.get_url()).content)
+        self.client.login(username="test", password="!")
+        self.assertFalse("frozen" in self.client.get(thread.get_url()).content)
+        
+        moderation.close_threads([thread.pk], False)
+        self.assertFalse(os.path.exists(path))
+        freezer.freeze()
+        self.assertFalse(os.path.exists(path))
+    
+    def test_rename_and_errors(self):
+        from snapboard import freezer, moderation
+        
+        moderation.close_threads([1])
+        thread = smodels.Thread.objects.get(pk=1)
+        thread.slug = "renamed"
+        thread.save()
+        freezer.freeze()
+        self.assertTrue(os.path.exists(freezer.get_path("category", "renamed")))
+        
+        def fail(path, content):
+            raise IOError(path)
+        write, freezer.write = freezer.write, fail
+        try:
+            freezer.enqueue([("category", "renamed")])
+            self.assertEquals(freezer.freeze(), 1)
+        finally:
+            freezer.write = write
+        # Queued again.
+        self.assertEquals(freezer.freeze(), 1)
+        self.assertTrue(os.path.exists(freezer.get_path("category", "renamed")))
+
+
+class BanTest(TestCase):
+    fixtures = ["test_data.json"]
+    
+    def test_ip_bans(self):
+        from snapboard.bans import get_index
+        
+        self.assertFalse(get_index().is_ip_banned("10.1.2.3"))
+        smodels.IPBan.objects.create(address="10.0.0.0/8")
+        smodels.IPBan.objects.create(address="192.168.1.7")
+        index = get_index()
+        self.assertTrue(index.is_ip_banned("10.1.2.3"))
+        self.assertTrue(index.is_ip_banned("192.168.1.7"))
+        self.assertFalse(index.is_ip_banned("192.168.1.8"))
+        self.assertFalse(index.is_ip_banned("11.0.0.0"))
+    
+    def test_user_bans(self):
+        from snapboard.bans import get_index
+        
+        user = User.objects.get(username="test")
+        self.assertFalse(get_index().is_user_banned(user))
+        smodels.UserBan.objects.create(user=user)
+        self.assertTrue(get_index().is_user_banned(user))
+    
+    def test_api_views(self):
+        from snapboard.middleware.ban import is_snapboard_view
+        
+        # A piston Resource wrapping a handler of snapboard.api or not.
+        resource = type("Resource", (object,), {"__module__": "piston.resource"})
+        handler = type("ThreadHandler", (object,), 
+            {"__module__": "snapboard.api.handlers"})
+        view = resource()
+        self.assertFalse(is_snapboard_view(view))
+        view.handler = handler()
+        self.assertTrue(is_snapboard_view(view))
+
+
+class ModerationTest(TestCase):
+    urls = "snapboard.tests.test_urls"
+    fixtures = ["test_data.json"]
+    
+    def test_bulk(self):
+        self.client.login(username="test", password="!")
+        uri = reverse("sb_bulk")
+        r = self.client.post(uri, {"action": "close", "id": [1]})
+        self.assertEquals(r.status_code, 200)
+        self.assertTrue(smodels.Thread.objects.get(pk=1).closed)
+    
+    def test_delete(self):
+        from snapboard import moderation
+        
+        self.assertEquals(moderation.delete_threads([1]), 1)
+        self.assertFalse(smodels.Thread.objects.filter(pk=1))
+        self.assertFalse(smodels.Post.objects.filter(thread=1))
+    
+    def test_rollups(self):
+        from snapboard import moderation
+        
+        smodels.Category.objects.refresh_rollups()
+        thread = smodels.Thread.objects.get(pk=1)
+        category = smodels.Category.objects.get(pk=thread.category_id)
+        user = User.objects.get(username="test")
+        
+        post = smodels.Post.objects.create_and_notify(thread, user, text="rollup")
+        updated = smodels.Category.objects.get(pk=category.pk)
+        self.assertEquals(updated.post_count, category.post_count + 1)
+        self.assertEquals(updated.last_post_id, post.pk)
+        self.assertEquals(updated.last_post_user, "test")
+        
+        moderation.delete_threads([1])
+        updated = smodels.Category.objects.get(pk=category.pk)
+        self.assertEquals(updated.thread_count, category.thread_count - 1)
+        self.assertEquals(updated.post_count, 
+            smodels.Post.objects.filter(thread__category=category).count())
+    
+    def test_admin_rollups(self):
+        from django.contrib import admin
+        from snapboard.admin import ThreadAdmin
+        
+        other = smodels.Category.objects.create(name="other", slug="other")
+        smodels.Category.objects.refresh_rollups()
+        thread = smodels.Thread.objects.get(pk=1)
+        posts = thread.post_set.count()
+        
+        thread.category = other
+        ThreadAdmin(smodels.Thread, admin.site).save_model(None, thread, None, True)
+        moved = smodels.Category.objects.get(pk=other.pk)
+        self.assertEquals((moved.thread_count, moved.post_count), (1, posts))
+        left = smodels.Category.objects.get(pk=1)
+        self.assertEquals((left.thread_count, left.post_count), (0, 0))
+    
+    def test_purge(self):
+        from django.core.management import call_command
+        from snapboard import moderation
+        
+        user = User.objects.get(username="jiveturkey")
+        other = User.objects.get(username="blackdynamite")
+        owned = smodels.Thread.objects.create_thread(user=user, category_id=1,
+            name="owned")
+        smodels.Post.objects.create(thread=owned, user=user, text="a")
+        smodels.Post.objects.create(thread=owned, user=other, text="b")
+        emptied = smodels.Thread.objects.create_thread(user=other, 
+            category_id=1, name="emptied")
+        smodels.Post.objects.create(thread=emptied, user=user, text="c")
+        smodels.Post.objects.create(thread_id=1, user=user, text="d")
+        
+        posts = smodels.Post.objects.count()
+        expected = {"posts": 4, "threads": 2, "updated_threads": 1}
+        self.assertEquals(moderation.purge(user, dry_run=True), expected)
+        self.assertEquals(smodels.Post.objects.count(), posts)
+        
+        call_command("snapboard_purge", username="jiveturkey")
+        self.assertEquals(smodels.Post.objects.count(), posts - 4)
+        self.assertFalse(smodels.Thread.objects.filter(pk__in=[owned.pk, 
+            emptied.pk]))
+        self.assertFalse(smodels.Post.objects.filter(user=user))
+        self.assertTrue(smodels.Thread.objects.filter(pk=1))
+
+
+class ArchiveTest(TestCase):
+    urls = "snapboard.tests.test_urls"
+    fixtures = ["test_data.json"]
+    
+    def setUp(self):
+        from snapboard import archive
+        self.assertEquals(archive.archive_threads([1]), 1)
+        self.uri = reverse("sb_thread", args=("category", "thread"))
+    
+    def tearDown(self):
+        from snapboard import routers
+        from snapboard.localcache import tiered
+        cache.clear()
+        tiered.local.clear()
+        routers.unpin()
+    
+    def test_archive(self):
+        from snapboard import archive, routers, streaming
+        
+        self.assertFalse(smodels.Thread.objects.filter(pk=1))
+        self.assertFalse(smodels.Post.objects.filter(thread=1))
+        archived = archive.get_archived_thread("category", "thread")
+        self.assertEquals([post.pk for post in archived.get_posts()], [1])
+        # Streaming loads the authors of archived posts with the chunk.
+        post = list(streaming.iter_posts(archived))[0]
+        self.assertEquals(post._user_cache.pk, post.user_id)
+        self.assertEquals(archive.get_archived_thread("other", "thread"), None)
+        
+        thread = archive.restore_thread(archived)
+        self.assertEquals(thread.pk, 1)
+        self.assertFalse(routers.is_pinned())
+        self.assertEquals(smodels.Post.objects.filter(thread=1).count(), 1)
+        self.assertFalse(smodels.ArchivedThread.objects.filter(pk=1))
+        self.assertEquals(smodels.Category.objects.get(pk=1).thread_count,
+            smodels.Thread.objects.filter(category=1).count())
+        
+        # A copy left by an interrupted restore isn't served.
+        archive.copy_threads([1], archive.get_archive_db())
+        self.assertEquals(archive.get_archived_thread("category", "thread"), None)
+    
+    def test_archived_view(self):
+        r = self.client.get(self.uri)
+        self.assertTemplateUsed(r, "snapboard/thread.html")
+        self.assertTrue(r.context["archived"])
+        
+        # Anonymous and invalid posts leave the thread archived.
+        self.client.post(self.uri, {"post": "post"})
+        self.client.login(username="jiveturkey", password="!")
+        r = self.client.post(self.uri, {"post": ""})
+        self.assertTemplateUsed(r, "snapboard/thread.html")
+        self.assertFalse(smodels.Thread.objects.filter(pk=1))
+        
+        r = self.client.post(self.uri, {"post": "reply"})
+        post = smodels.Post.objects.get(text="reply")
+        self.assertRedirects(r, post.get_url())
+        self.assertEquals(post.thread_id, 1)
+        self.assertEquals(smodels.Thread.objects.get(pk=1).date, post.date)
+        self.assertEquals(smodels.Post.objects.filter(thread=1).count(), 2)
+        self.assertFalse(smodels.ArchivedThread.objects.filter(pk=1))
+
+
+class RouterTest(TestCase):
+    def setUp(self):
+        from snapboard import routers
+        self.old_replicas = routers.REPLICAS
+        routers.REPLICAS = ("replica",)
+        routers.unpin()
+    
+    def tearDown(self):
+        from snapboard import routers
+        routers.REPLICAS = self.old_replicas
+        routers.unpin()
+    
+    def test_pinning(self):
+        from django.core.signals import request_finished
+        from django.http import HttpRequest, HttpResponse
+        from snapboard import routers
+        from snapboard.middleware.replica import ReplicaPinningMiddleware
+        
+        router = routers.ReplicaRouter()
+        self.assertEquals(router.db_for_read(smodels.Thread), "replica")
+        self.assertEquals(router.db_for_write(smodels.Thread), routers.PRIMARY)
+        self.assertEquals(router.db_for_read(User), None)
+        
+        routers.pin_to_primary()
+        self.assertEquals(router.db_for_read(smodels.Thread), routers.PRIMARY)
+        request_finished.send(sender=None)
+        self.assertEquals(router.db_for_read(smodels.Thread), "replica")
+        
+        # The client's next requests stay on the primary.
+        middleware = ReplicaPinningMiddleware()
+        request = HttpRequest()
+        middleware.process_request(request)
+        routers.pin_to_primary()
+        response = middleware.process_response(request, HttpResponse())
+        self.assertTrue(routers.PIN_COOKIE in response.cookies)
+        request.COOKIES[routers.PIN_COOKIE] = "1"
+        middleware.process_request(request)
+        self.assertEquals(router.db_for_read(smodels.Thread), routers.PRIMARY)
+        self.assertFalse(routers.has_written())
+
+
+class AutocompleteTest(TestCase):
+    urls = "snapboard.tests.test_urls"
+    fixtures = ["test_data.json"]
+    
+    def setUp(self):
+        from snapboard.autocomplete import indexes
+        cache.clear()
+        indexes.built = None
+    
+    def test_threads(self):
+        user = User.objects.get(username="jiveturkey")
+        smodels.Thread.objects.create_thread(user=user, category_id=1, 
+            name="Caching strategies")
+        smodels.Thread.objects.create_thread(user=user, category_id=1, 
+            name="Cache secret", private=True)
+        uri = reverse("sb_autocomplete")
+        
+        r = self.client.get(uri, {"q": "cach"})
+        self.assertEquals(r.content.count('"name"'), 1)
+        
+        # Indexed as soon as it's created.
+        smodels.Thread.objects.create_thread(user=user, category_id=1, 
+            name="Strategies for cache keys")
+        r = self.client.get(uri, {"q": "strat cach"})
+        self.assertEquals(r.content.count('"name"'), 2)
+        
+        self.client.login(username="jiveturkey", password="!")
+        r = self.client.get(uri, {"q": "secret"})
+        self.assertTrue("Cache secret" in r.content)
+    
+    def test_users(self):
+        r = self.client.get(reverse("sb_autocomplete"), {"q": "JIVE", "kind": "user"})
+        self.assertTrue("jiveturkey" in r.content)
+        self.assertFalse("blackdynamite" in r.content)
+
+
+class RateLimitTest(TestCase):
+    urls = "snapboard.tests.test_urls"
+    
+    def setUp(self):
+        from snapboard import ratelimit
+        self._old_limit = ratelimit.RATE_LIMITS["preview"]
+        ratelimit.RATE_LIMITS["preview"] = (0.001, 2)
+    
+    def tearDown(self):
+        from snapboard import ratelimit
+        ratelimit.RATE_LIMITS["preview"] = self._old_limit
+        cache.clear()
+    
+    def test_preview(self):
+        uri = reverse("sb_preview")
+        for i in range(2):
+            r = self.client.post(uri, {"text": "text"})
+            self.assertEquals(r.status_code, 200)
+        r = self.client.post(uri, {"text": "text"})
+        self.assertEquals(r.status_code, 429)
+        self.assertTrue(int(r["Retry-After"]) > 0)
+
+
 class ThreadTest(TestCase):
     fixtures = ["test_data.json"]
+    
+    def tearDown(self):
+        from snapboard.localcache import tiered
+        cache.clear()
+        tiered.local.clear()
 
     def test_get_notify_recipients(self):
         # should just return a set of the admins
         r = smodels.Thread.objects.get(pk=1).get_notify_recipients()
         self.assertEquals(r, set([t[1] for t in settings.ADMINS]))
+    
+    def test_user_query_set(self):
+        from datetime import datetime, timedelta
+        from django.db.models import Q
+        from snapboard.managers import MergedQuerySet
+        
+        user = User.objects.get(username="jiveturkey")
+        other = User.objects.get(username="blackdynamite")
+        start = datetime(2010, 1, 1)
+        for i in range(6):
+            smodels.Thread.objects.create(user=[user, other][i % 2], 
+                category_id=1, name="t%i" % i, slug="t%i" % i, private=i in (0, 2),
+                sticky=i == 5, date=start + timedelta(days=i))
+        cache.clear()
+        
+        threads = smodels.Thread.objects.get_user_query_set(user)
+        expected = list(smodels.Thread.objects.order_by('-sticky', '-date')
+            .filter(Q(private=False) | Q(private=True) & Q(user=user)))
+        self.assertEquals(list(threads), expected)
+        self.assertEquals(threads.count(), len(expected))
+        self.assertEquals(threads[1:3], expected[1:3])
+        self.assertEquals(list(threads.after(expected[1].sticky, 
+            expected[1].date)), expected[2:])
+        
+        # Without private threads, a plain queryset.
+        self.assertFalse(isinstance(smodels.Thread.objects
+            .get_user_query_set(other), MergedQuerySet))
+        
+        rows = smodels.Thread.objects.rows(threads)
+        self.assertEquals([row.pk for row in rows], [t.pk for t in expected])
+        self.assertEquals([row.get_url() for row in rows[1:3]], 
+            [t.get_url() for t in expected[1:3]])
+        row = rows[0]
+        self.assertEquals((row.username, row.category_name), 
+            (expected[0].user.username, expected[0].category.name))
+        # The templates' paths into the model still work.
+        self.assertEquals((row.user.username, unicode(row.user), 
+            row.category.slug, unicode(row.category)), 
+            (expected[0].user.username, expected[0].user.username, 
+            expected[0].category.slug, expected[0].category.name))
+        self.assertEquals(row.get_post_count(), expected[0].get_post_count())
+        self.assertEquals(row.get_page_count(), expected[0].get_page_count())
+        self.assertEquals(row.get_last_post(), expected[0].get_last_post())
+        self.assertEquals(bool(row.is_fav(user)), bool(expected[0].is_fav(user)))
+    
+    def test_renamed_slugs(self):
+        thread = smodels.Thread.objects.get(pk=1)
+        old_url = thread.get_url()
+        self.assertEquals(self.client.get(old_url).status_code, 200)
+        
+        thread.slug = "renamed"
+        thread.save()
+        r = self.client.get(old_url)
+        self.assertEquals(r.status_code, 301)
+        self.assertTrue(r["Location"].endswith(thread.get_url()))
+        self.assertEquals(self.client.get(thread.get_url()).status_code, 200)
+        # The old slug stays taken by the redirect.
+        self.assertEquals(smodels.Thread.objects.get_slug("thread"), "thread-1")
+        
+        category = thread.category
+        old_category_url = reverse("sb_category", args=(category.slug,))
+        category.slug = "moved"
+        category.save()
+        # Saves that don't change the slug don't record it again.
+        category.save()
+        self.assertEquals(smodels.SlugHistory.objects.count(), 2)
+        r = self.client.get(old_category_url)
+        self.assertTrue(r["Location"].endswith(reverse("sb_category", 
+            args=("moved",))))
+        for url in (old_url, reverse("sb_thread", args=("category", "renamed"))):
+            r = self.client.get(url, follow=True)
+            self.assertEquals(r.redirect_chain[0][1], 301)
+            self.assertEquals(r.request["PATH_INFO"], "/moved/renamed/")
+    
+    def test_streaming(self):
+        from django.template import Context
+        from django.utils import simplejson
+        from snapboard import streaming
+        
+        thread = smodels.Thread.objects.get(pk=1)
+        user = User.objects.get(username="jiveturkey")
+        for i in range(5):
+            smodels.Post.objects.create(thread=thread, user=user, 
+                text="streamed %i" % i)
+        posts = list(thread.get_posts().order_by("date", "pk"))
+        self.assertEquals(list(streaming.iter_posts(thread, 2)), posts)
+        self.assertEquals(streaming.second_pass("{{ x }}", Context({"x": 1})), "1")
+        
+        args = ("category", "thread")
+        r = self.client.get(reverse("sb_thread_all", args=args))
+        self.assertTemplateUsed(r, "snapboard/thread_all.html")
+        self.assertEquals(r.context["thread"], thread)
+        content = r.content
+        positions = [content.index(post.text) for post in posts]
+        self.assertEquals(positions, sorted(positions))
+        
+        r = self.client.get(reverse("sb_thread_export", args=args + ("json",)))
+        self.assertEquals(r["Content-Type"], "application/json")
+        data = simplejson.loads(r.content)
+        self.assertEquals(data["thread"]["name"], thread.name)
+        self.assertEquals([(post["id"], post["user"], post["text"]) 
+            for post in data["posts"]], 
+            [(post.pk, post.user.username, post.text) for post in posts])
+        
+        r = self.client.get(reverse("sb_thread_export", args=args + ("txt",)))
+        content = r.content.decode("utf-8")
+        self.assertTrue(content.startswith(thread.name + "\n"))
+        positions = [content.index(u"%s, %s\n\n%s\n\n" % (post.user.username, 
+            post.date, post.text)) for post in posts]
+        self.assertEquals(positions, sorted(positions))
+        # Closing the response read keeps the connection and its transaction.
+        r.close()
+        self.assertEquals(thread.get_posts().count(), len(posts))
+    
+    def test_author_stats(self):
+        from snapboard import moderation
+        
+        user = User.objects.get(username="jiveturkey")
+        thread = smodels.Thread.objects.create_thread(user=user, category_id=1,
+            name="stats")
+        post = smodels.Post.objects.create_and_notify(thread, user, text="a")
+        smodels.Post.objects.create_and_notify(thread, user, text="b")
+        
+        posts = list(thread.get_posts())
+        self.assertTrue(hasattr(posts[0].user, "_sb_usersettings_cache"))
+        stats = posts[0].user.sb_usersettings
+        self.assertEquals((stats.post_count, stats.thread_count), (2, 1))
+        
+        post.delete()
+        stats = smodels.UserSettings.objects.get(user=user)
+        self.assertEquals(stats.post_count, 1)
+        
+        moderation.delete_threads([thread.pk])
+        stats = smodels.UserSettings.objects.get(user=user)
+        self.assertEquals((stats.post_count, stats.thread_count), (0, 0))
         
         
 class UtilsTest(TestCase):
@@ -161,6 +834,21 @@ class UtilsTest(TestCase):
         self.assertEquals(len(mail.outbox), 1)
         self.assertEquals(mail.outbox[0].to, ["from@example.com"])
         self.assertEquals(mail.outbox[0].bcc, recipient_list)
+    
+    def test_bundles(self):
+        import shutil, tempfile
+        from snapboard import bundles
+        
+        root = tempfile.mkdtemp()
+        try:
+            manifest = bundles.build(bundle_root=root)
+            for name, filename in manifest.items():
+                self.assertTrue(os.path.exists(os.path.join(root, filename + ".gz")))
+        finally:
+            shutil.rmtree(root)
+        css = bundles.rebase_css_urls("a{background:url('../img/x.png')}",
+            "css/yui/y.css", "bundles")
+        self.assertEquals(css, "a{background:url(../css/img/x.png)}")
 
 
 class APITest(TestCase):
@@ -192,4 +880,17 @@ class APITest(TestCase):
         
         auth = "Basic %s" % base64.b64encode("test:!")
         r = self.client.post(uri, data, HTTP_AUTHORIZATION=auth)
+
+    def test_token(self):
+        uri = "/api/thread/"
+        user = User.objects.get(username="test")
+        key = smodels.APIToken.objects.create_token(user)
         
+        auth = "Token %s" % key
+        r = self.client.post(uri, {}, HTTP_AUTHORIZATION=auth)
+        self.assertNotEquals(r.content, 'Authorization Required')
+        
+        # Revoked tokens are refused.
+        smodels.APIToken.objects.revoke(user)
+        r = self.client.post(uri, {}, HTTP_AUTHORIZATION=auth)
+        self.assertEquals(r.content, 'Authorization Required')
@@ -21,19 +21,29 @@ urlpatterns += patterns('snapboard.views',
     (r'^(?P<slug>[-_\w]+)/new/$', 'new_thread', {}, 'sb_new_thread'),
     (r'^$', 'category_list', {}, 'sb_category_list'),
     (r'^latest/$', 'thread_list', {}, 'sb_thread_list'),
+    (r'^hot/$', 'hot_list', {}, 'sb_hot_list'),
+    (r'^hot/(?P<slug>[-_\w]+)/$', 'hot_list', {}, 'sb_category_hot_list'),
     (r'^search/$', 'search', {}, 'sb_search'),
     (r'^favorites/$', 'favorites', {}, 'sb_favorites'),
     (r'^settings/$', 'edit_settings', {}, 'sb_edit_settings'),
+    (r'^sitemap\.xml$', 'sitemap_index', {}, 'sb_sitemap_index'),
+    (r'^sitemap-(?P<chunk>\d+)\.xml$', 'sitemap', {}, 'sb_sitemap'),
     
     # Ajax
     (r'^rpc/edit/$', 'edit', {}, 'sb_edit'),
     (r'^rpc/preview/$', 'preview', {}, 'sb_preview'),
     (r'^rpc/sticky/$', 'sticky', {}, 'sb_sticky'),
     (r'^rpc/close/$', 'close', {}, 'sb_close'),
+    (r'^rpc/bulk/$', 'bulk', {}, 'sb_bulk'),
     (r'^rpc/watch/$', 'watch', {}, 'sb_watch'),
+    (r'^rpc/autocomplete/$', 'autocomplete', {}, 'sb_autocomplete'),
     
     # Categories / Threads
     (r'^(?P<cslug>[-_\w]+)/(?P<tslug>[-_\w]+)/$', 'thread', {}, 'sb_thread'),
+    (r'^(?P<cslug>[-_\w]+)/(?P<tslug>[-_\w]+)/all/$', 'thread_all', {}, 
+        'sb_thread_all'),
+    (r'^(?P<cslug>[-_\w]+)/(?P<tslug>[-_\w]+)/export\.(?P<format>txt|json)$', 
+        'thread_export', {}, 'sb_thread_export'),
     (r'^(?P<slug>[-_\w]+)/$', 'category', {}, 'sb_category'),
 )
 
@@ -1,5 +1,8 @@
+import gzip
+import re
 import time
 import urllib
+from cStringIO import StringIO
 
 from django.conf import settings
 from django.core.cache import cache
@@ -8,6 +11,7 @@ from django.http import HttpResponse
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 from django.template.loader import render_to_string
+from django.utils.text import compress_string
 
 
 # Forms
@@ -61,32 +65,195 @@ def sanitize(s):
 # Caching
 # -------
 
+# Seconds a worker may hold the lock while it regenerates a page.
+CACHE_LOCK_TIMEOUT = getattr(settings, 'SB_CACHE_LOCK_TIMEOUT', 30)
+# Seconds after an invalidation during which the previous page may be served.
+CACHE_STALE_GRACE = getattr(settings, 'SB_CACHE_STALE_GRACE', 60)
+
 def render_and_cache(template_name, context, request, prefix="", timeout=None):
     response = render(template_name, context, request)
     if request.method == 'POST':
         return response
     
+    from snapboard.localcache import tiered
+    
     prefix_key = get_prefix_cache_key(request)
-    prefix = cache.get(prefix_key)
+    # CachedTemplateMiddleware has just looked the prefix up.
+    prefix = getattr(request, 'sb_cache_prefix', None)
+    if prefix in (None, "0"):
+        prefix = cache.get(prefix_key)
     if prefix is None:
-        prefix = int(time.time())
-        cache.set(prefix_key, prefix)
+        prefix = new_cache_prefix()
+        tiered.set(prefix_key, prefix)
     
     response_key = get_response_cache_key(prefix, request)
-    cache.set(response_key, response, timeout)
+    # Remember this generation so it can be served while the next one renders.
+    cache.set_many({
+        response_key: pack_response(response),
+        get_stale_cache_key(request): prefix,
+    }, timeout)
     
     return response
 
+def get_cached_response(request):
+    '''
+    Returns the cache prefix of the request's path and the cached response 
+    record (see ``pack_response``), or None if the page isn't cached.
+    
+    The prefix this process saw last is used to fetch both in a single round
+    trip. A second one is only needed after the page has been invalidated.
+    
+    '''
+    from snapboard.localcache import tiered
+    
+    prefix_key = get_prefix_cache_key(request)
+    guess = tiered.local.get(prefix_key, stale=True)
+    if guess is None:
+        prefix = cache.get(prefix_key, "0")
+        response = cache.get(get_response_cache_key(prefix, request))
+    else:
+        guess_key = get_response_cache_key(guess, request)
+        found = cache.get_many([prefix_key, guess_key])
+        prefix = found.get(prefix_key, "0")
+        if str(prefix) == str(guess):
+            response = found.get(guess_key)
+        else:
+            response = cache.get(get_response_cache_key(prefix, request))
+    tiered.local.set(prefix_key, prefix)
+    return prefix, response
+
+# Headers kept in cached responses, the others are dropped.
+CACHED_HEADERS = ('Content-Type', 'Content-Language')
+
+re_accepts_gzip = re.compile(r'\bgzip\b')
+
+def needs_second_pass(response):
+    # Cached pages are rendered again per request if they contain template
+    # code preserved with {% raw %}.
+    content = response.content
+    return response['Content-Type'].startswith('text/html') and \
+        ('{%' in content or '{{' in content)
+
+def pack_response(response):
+    '''
+    Returns a compact record of response for the cache: the status, a 
+    minimal header list, the gzipped body and whether the body is final, ie.
+    doesn't need a second rendering pass.
+    
+    '''
+    headers = [(k, response[k]) for k in CACHED_HEADERS if response.has_header(k)]
+    final = not needs_second_pass(response)
+    return (response.status_code, headers, compress_string(response.content), final)
+
+def unpack_response(record, request):
+    '''
+    Builds a response from a record made by ``pack_response``. Final bodies
+    are sent still compressed to clients that accept gzip.
+    
+    '''
+    status, headers, body, final = record
+    if final and re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = HttpResponse(body)
+        response['Content-Encoding'] = 'gzip'
+        response['Content-Length'] = str(len(body))
+        response['Vary'] = 'Accept-Encoding'
+    else:
+        response = HttpResponse(gzip.GzipFile(fileobj=StringIO(body)).read())
+    response.status_code = status
+    for k, v in headers:
+        response[k] = v
+    response.sb_final = final
+    return response
+
 # TODO: Document
 #       Last updated doesn't have to take into account ?page
 #       update.<path> --- cached timestamp
 #       <timestamp>.<path> --- cached template
+#       stale.<path> --- timestamp of the last cached template
+#       lock.<timestamp>.<path> --- held while the template is rendered
 def get_response_cache_key(prefix, request):
     return "%s.%s" % (prefix, urllib.quote(request.get_full_path()))
 
 def get_prefix_cache_key(request):
     return "updated.%s" % getattr(request, "path", request)
 
+def get_stale_cache_key(request):
+    return "stale.%s" % urllib.quote(request.get_full_path())
+
+def get_lock_cache_key(response_key):
+    return "lock.%s" % response_key
+
+def new_cache_prefix():
+    # In milliseconds, so that two invalidations within a second differ.
+    return int(time.time() * 1000)
+
+
+class CacheQueue(object):
+    """
+    A FIFO queue kept in the shared cache, so that any process can feed a 
+    worker command. Items are stored in numbered slots and the tail counter 
+    is advanced with an atomic increment. There must be a single consumer.
+    
+    Items put while the consumer is draining may be skipped, as may items
+    evicted from the cache; don't use this for anything that can't be lost.
+    
+    """
+    def __init__(self, name, timeout=None):
+        self.name = name
+        self.timeout = timeout
+    
+    def get_key(self, suffix):
+        return "sb.queue.%s.%s" % (self.name, suffix)
+    
+    def put(self, item):
+        tail_key = self.get_key("tail")
+        cache.add(tail_key, 0)
+        try:
+            index = cache.incr(tail_key)
+        except ValueError:
+            return
+        cache.set(self.get_key(index), item, self.timeout)
+    
+    def pop_many(self, limit=100):
+        head_key = self.get_key("head")
+        tail_key = self.get_key("tail")
+        counters = cache.get_many([head_key, tail_key])
+        head = counters.get(head_key, 0)
+        tail = counters.get(tail_key, 0)
+        if tail < head:
+            # The tail was evicted and started over.
+            head = 0
+        end = min(tail, head + limit)
+        if end <= head:
+            return []
+        
+        keys = [self.get_key(i) for i in range(head + 1, end + 1)]
+        slots = cache.get_many(keys)
+        cache.set(head_key, end)
+        cache.delete_many(keys)
+        return [slots[key] for key in keys if key in slots]
+    
+    def get_tail(self):
+        return cache.get(self.get_key("tail"), 0)
+    
+    def read(self, after, limit=100):
+        '''
+        Returns (index, items), the items put after the index given and the 
+        index of the last of them, without removing them: for queues read by
+        every process, which keep track of the index. items is None when 
+        some were lost and the reader has to start over from index.
+        
+        '''
+        tail = self.get_tail()
+        if tail < after:
+            return tail, None
+        end = min(tail, after + limit)
+        keys = [self.get_key(i) for i in range(after + 1, end + 1)]
+        slots = cache.get_many(keys)
+        if len(slots) < len(keys):
+            return end, None
+        return end, [slots[key] for key in keys]
+
 
 # Mail
 # ----
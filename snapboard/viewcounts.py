@@ -0,0 +1,168 @@
+"""
+Thread view counters.
+
+Views are counted by CachedTemplateMiddleware, so pages served from the
+cache count too, with an atomic increment of a shared cache counter per
+thread and epoch of SB_VIEWS_EPOCH seconds. The first view of a thread in
+an epoch adds its slug to the epoch's CacheQueue. If the cache can't be
+reached, views are buffered in process and added later.
+
+The snapboard_flush_views command adds the counters of finished epochs to
+Thread.views and to the Thread.hot scores, with one UPDATE per batch of
+threads. As no view is counted in a finished epoch, its counters can be
+read and deleted without losing increments.
+
+"""
+import time
+import urllib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router, transaction
+
+from snapboard import hot, stats
+from snapboard.models import Thread
+from snapboard.utils import CacheQueue
+
+
+EPOCH = getattr(settings, 'SB_VIEWS_EPOCH', 60)
+# Counters of unflushed epochs expire after this many seconds.
+TIMEOUT = getattr(settings, 'SB_VIEWS_TIMEOUT', 24 * 60 * 60)
+BATCH_SIZE = 500
+
+FLUSHED_KEY = 'sb.views.flushed'
+
+# Views not yet added to the shared cache, by (epoch, slug).
+_pending = {}
+
+
+def get_epoch(now=None):
+    return int((now or time.time()) // EPOCH)
+
+def get_queue(epoch):
+    return CacheQueue('views.%i' % epoch, TIMEOUT)
+
+def get_counter_key(epoch, slug):
+    return 'sb.views.%i.%s' % (epoch, urllib.quote(slug))
+
+def incr(epoch, slug, delta=1):
+    '''
+    Adds delta views of the thread slug to the epoch's counter. Returns False
+    if the cache couldn't be updated.
+
+    '''
+    key = get_counter_key(epoch, slug)
+    try:
+        cache.incr(key, delta)
+        return True
+    except ValueError:
+        pass
+    if cache.add(key, delta, TIMEOUT):
+        get_queue(epoch).put(slug)
+        return True
+    # Someone else created it meanwhile.
+    try:
+        cache.incr(key, delta)
+        return True
+    except ValueError:
+        return False
+
+def count_view(slug):
+    epoch = get_epoch()
+    if _pending:
+        retry_pending()
+    if not incr(epoch, slug):
+        _pending[(epoch, slug)] = _pending.get((epoch, slug), 0) + 1
+        stats.incr('views.buffered')
+
+def retry_pending():
+    # Older epochs may be flushed already, their views go to this one.
+    epoch = get_epoch()
+    for key in _pending.keys():
+        delta = _pending.pop(key)
+        if not incr(epoch, key[1], delta):
+            _pending[key] = _pending.get(key, 0) + delta
+            return
+
+
+def get_counts(epoch):
+    '''
+    Reads and deletes the counters of a finished epoch. Returns a dict of
+    slug -> views.
+
+    '''
+    queue = get_queue(epoch)
+    counts = {}
+    while True:
+        slugs = queue.pop_many(1000)
+        if not slugs:
+            return counts
+        keys = dict((get_counter_key(epoch, slug), slug) for slug in slugs)
+        found = cache.get_many(keys.keys())
+        cache.delete_many(keys.keys())
+        for key, views in found.items():
+            counts[keys[key]] = counts.get(keys[key], 0) + int(views)
+
+@transaction.commit_on_success
+def add_views(counts, now=None):
+    '''
+    Adds counts, a dict of thread id -> views, to the view counts and hot 
+    scores of the threads, in one UPDATE per batch of threads.
+
+    '''
+    using = router.db_for_write(Thread)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = qn(Thread._meta.db_table)
+    pk = qn(Thread._meta.pk.column)
+    views = qn(Thread._meta.get_field('views').column)
+    score = qn(Thread._meta.get_field('hot').column)
+
+    # Locked in the same order by concurrent flushes.
+    items = sorted(counts.items())
+    cursor = connection.cursor()
+    for offset in range(0, len(items), BATCH_SIZE):
+        batch = items[offset:offset + BATCH_SIZE]
+        scores = hot.lock_scores([item[0] for item in batch], using)
+        cases = ' '.join(['WHEN %s THEN %s'] * len(batch))
+        params = []
+        for item in batch:
+            params.extend(item)
+        for thread_id, count in batch:
+            params.extend([thread_id, hot.add_event(scores.get(thread_id, 0.0),
+                count * hot.VIEW_WEIGHT, now)])
+        params.extend([thread_id for thread_id, count in batch])
+        cursor.execute('UPDATE %s SET %s = %s + CASE %s %s END, %s = CASE %s %s END '
+            'WHERE %s IN (%s)' % (table, views, views, pk, cases, score, pk, cases,
+            pk, ', '.join(['%s'] * len(batch))), params)
+    transaction.set_dirty(using=using)
+
+def flush(now=None):
+    '''
+    Adds the views counted in the finished epochs to the threads. Returns
+    the number of views added.
+
+    '''
+    # The current epoch and the one before, in case of clock skew between
+    # hosts, may still be counted in.
+    last = get_epoch(now) - 2
+    first = cache.get(FLUSHED_KEY)
+    if first is None:
+        first = last - TIMEOUT // EPOCH
+
+    total = 0
+    for epoch in range(first + 1, last + 1):
+        counts = get_counts(epoch)
+        if not counts:
+            continue
+        ids = dict(Thread.objects.filter(slug__in=counts.keys())
+            .values_list('slug', 'pk'))
+        counts = dict((ids[slug], views) for slug, views in counts.items()
+            if slug in ids)
+        add_views(counts, (epoch + 1) * EPOCH)
+        total += sum(counts.values())
+        hot.forget(set(Thread.objects.filter(pk__in=counts.keys())
+            .values_list('category', flat=True)))
+    cache.set(FLUSHED_KEY, max(last, first), TIMEOUT)
+    stats.incr('views.flushed', total)
+    return total
@@ -1,5 +1,7 @@
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, \
+    HttpResponsePermanentRedirect
+from django.core.urlresolvers import resolve, reverse
 from django.shortcuts import get_object_or_404
 from django.utils.translation import ugettext as _
 
@@ -7,14 +9,24 @@ from snapboard.auth.decorators import login_required
 
 from snapboard.forms import PostForm, UserSettingsForm, UserNameForm, ThreadForm
 
+from snapboard import archive
+from snapboard import freezer
+from snapboard import hot
+from snapboard.autocomplete import search_threads, search_users
 from snapboard import models as smodels
+from snapboard import moderation
+from snapboard import resolver
+from snapboard import sitemaps
+from snapboard import streaming
 
+from snapboard.ratelimit import rate_limit
 from snapboard.utils import json_response, render_and_cache, render, sanitize,\
-    toggle_boolean_field 
+    safe_int
 
 # Ajax
 # ----
 
+@rate_limit('preview')
 @json_response
 def preview(request):
     return {'preview': sanitize(request.POST.get('text', ''))}
@@ -23,20 +35,47 @@ def preview(request):
 @json_response
 def sticky(request):
     thread = get_object_or_404(smodels.Thread, pk=request.POST.get('id'))
-    if toggle_boolean_field(thread, 'sticky'):
+    if not thread.sticky:
+        moderation.stick_threads([thread.pk])
         return {'link':_('unstick'), 'msg':_('This topic is sticky!')}
     else:
+        moderation.stick_threads([thread.pk], False)
         return {'link':_('stick'), 'msg':_('This topic is not sticky.')}
 
 @staff_member_required
 @json_response
 def close(request):
     thread = get_object_or_404(smodels.Thread, pk=request.POST.get('id'))
-    if toggle_boolean_field(thread, 'closed'):
+    if not thread.closed:
+        moderation.close_threads([thread.pk])
         return {'link':_('open'), 'msg':_('This topic is closed.')}
     else:
+        moderation.close_threads([thread.pk], False)
         return {'link':_('close'), 'msg':_('This topic is open.')}
 
+@staff_member_required
+@json_response
+def bulk(request):
+    # Applies a moderation action to all the threads whose ids are posted.
+    ids = [safe_int(pk) for pk in request.POST.getlist('id')]
+    ids = [pk for pk in ids if pk is not None]
+    category = None
+    if request.POST.get('category'):
+        category = get_object_or_404(smodels.Category, pk=request.POST['category'])
+    try:
+        count = moderation.perform(request.POST.get('action'), ids, category)
+    except ValueError, e:
+        return {'error': unicode(e)}
+    return {'count': count, 'msg': _('%i topic(s) updated.') % count}
+
+@json_response
+def autocomplete(request):
+    # Thread titles matching ?q=, or usernames with &kind=user.
+    q = request.GET.get('q', '')
+    if request.GET.get('kind') == 'user':
+        return {'results': search_users(q)}
+    return {'results': search_threads(q, request.user)}
+
 @login_required
 @json_response
 def watch(request):
@@ -70,23 +109,61 @@ def edit(request):
 # -----
 
 def category_list(request, template='snapboard/category_list.html'):
-    ctx = {'categories': smodels.Category.objects.all()}    
+    # One query: the counts and the last post are rollup columns, which the
+    # template reads instead of calling get_last_post().
+    ctx = {'categories': smodels.Category.objects.all()}
     return render_and_cache(template, ctx, request)
 
 def category(request, slug, template='snapboard/category.html'):
-    category = get_object_or_404(smodels.Category, slug=slug)
-    threads = category.thread_set.get_user_query_set(request.user)
+    try:
+        category = smodels.Category.objects.get(slug=slug)
+    except smodels.Category.DoesNotExist:
+        url = resolver.get_category_redirect(slug)
+        if url is None:
+            raise Http404
+        return HttpResponsePermanentRedirect(url)
+    threads = smodels.Thread.objects.rows(
+        category.thread_set.get_user_query_set(request.user))
     ctx = {'category': category, 'threads': threads}
     return render_and_cache(template, ctx, request)
 
 def thread_list(request, template='snapboard/thread_list.html'):
     # TODO: Keep sticky posts from clogging up the list.
     threads = smodels.Thread.objects.get_user_query_set(request.user).order_by('-date')
+    threads = smodels.Thread.objects.rows(threads)
     return render_and_cache(template, {'threads': threads}, request)
 
+def hot_list(request, slug=None, template='snapboard/hot_list.html'):
+    category = None
+    if slug is not None:
+        category = get_object_or_404(smodels.Category, slug=slug)
+    threads = hot.get_hot_threads(request.user, category)
+    return render(template, {'threads': threads, 'category': category}, request)
+
+@rate_limit('post')
 def thread(request, cslug, tslug, template='snapboard/thread.html'):
-    thread = get_object_or_404(smodels.Thread.objects.filter(category__slug=cslug), slug=tslug)
+    if freezer.FREEZE_ROOT:
+        response = freezer.get_response(request, cslug, tslug)
+        if response is not None:
+            return response
+    
+    thread, url = resolver.get_thread(cslug, tslug)
+    if url is not None:
+        return HttpResponsePermanentRedirect(url)
     form = PostForm(request.POST or None, request=request)
+    if thread is None:
+        archived = archive.get_archived_thread(cslug, tslug)
+        if archived is None:
+            raise Http404
+        if request.user.is_authenticated() and form.is_valid():
+            # Replying brings the thread back.
+            post = archive.reply(archived, request.user, form.cleaned_data['post'],
+                request.META.get('REMOTE_ADDR'))
+            hot.record_post(post.thread)
+            post.notify()
+            return HttpResponseRedirect(post.get_url())
+        return archived_thread(request, archived, form, template)
+    
     if form.is_valid():
         post = form.save(thread)
         return HttpResponseRedirect(post.get_url())
@@ -100,14 +177,76 @@ def thread(request, cslug, tslug, template='snapboard/thread.html'):
     }
     return render_and_cache(template, ctx, request)
 
+# Counted by CachedTemplateMiddleware, cached pages included.
+thread.sb_counts_views = True
+
+def archived_thread(request, thread, form, template='snapboard/thread.html'):
+    # Read-only display of an archived thread.
+    ctx = {
+        'is_fav': False,
+        'posts': thread.get_posts(),
+        'thread': thread,
+        'form': form,
+        'category': thread.category,
+        'archived': True,
+    }
+    return render_and_cache(template, ctx, request)
+
+def find_thread(cslug, tslug):
+    '''
+    Returns (thread, None) for the live or archived thread at cslug/tslug, or
+    (None, URL) if it is now at URL. Raises Http404 if there's no such thread.
+    
+    '''
+    thread, url = resolver.get_thread(cslug, tslug)
+    if thread is None and url is None:
+        thread = archive.get_archived_thread(cslug, tslug)
+        if thread is None:
+            raise Http404
+    return thread, url
+
+def moved(url, name, **kwargs):
+    # Redirects to the view name of the thread now at url.
+    kwargs.update(resolve(url)[2])
+    return HttpResponsePermanentRedirect(reverse(name, kwargs=kwargs))
+
+def thread_all(request, cslug, tslug, template='snapboard/thread_all.html'):
+    thread, url = find_thread(cslug, tslug)
+    if url is not None:
+        return moved(url, 'sb_thread_all')
+    ctx = {
+        'thread': thread,
+        'category': thread.category,
+        'archived': isinstance(thread, smodels.ArchivedThread),
+    }
+    return streaming.stream_page(request, template, ctx)
+
+def thread_export(request, cslug, tslug, format):
+    thread, url = find_thread(cslug, tslug)
+    if url is not None:
+        return moved(url, 'sb_thread_export', format=format)
+    return streaming.stream_export(thread, format)
+
+def sitemap_index(request):
+    return stream_xml(sitemaps.generate_index(sitemaps.get_base_url(request)))
+
+def sitemap(request, chunk):
+    return stream_xml(sitemaps.generate(int(chunk), 
+        sitemaps.get_base_url(request)))
+
+def stream_xml(content):
+    return streaming.StreamingResponse(content, mimetype='application/xml')
+
 def search(request, template='snapboard/search.html'):
     threads = smodels.Thread.objects.get_user_query_set(request.user)
     q = request.GET.get('q')
     if q is not None:
         threads = threads.filter(name__icontains=q)
+    threads = smodels.Thread.objects.rows(threads)
     return render(template, {'threads': threads}, request)
 
 @login_required
+@rate_limit('new_thread')
 def new_thread(request, slug=None, template='snapboard/new_thread.html'):
     category = None
     if slug is not None:
@@ -120,7 +259,8 @@ def new_thread(request, slug=None, template='snapboard/new_thread.html'):
 
 @login_required
 def favorites(request, template='snapboard/favorites.html'):
-    threads = smodels.Thread.objects.favorites(request.user)
+    threads = smodels.Thread.objects.rows(
+        smodels.Thread.objects.favorites(request.user))
     return render(template, {'threads': threads}, request)
 
 @login_required
@@ -0,0 +1,59 @@
+"""
+Re-renders pages after their cache has been invalidated by a write.
+
+Invalidated paths are queued in the shared cache; the ``snapboard_warm`` 
+command drains the queue and requests each path as an anonymous user, which 
+puts the page back into the cache through the regular middleware. Enable 
+with SB_WARM_CACHE = True and keep the command running.
+
+"""
+import urllib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test.client import Client
+
+from snapboard import stats
+from snapboard.utils import CacheQueue
+
+
+WARM_CACHE = getattr(settings, 'SB_WARM_CACHE', False)
+# Requests for a path that is already queued are dropped for this many seconds.
+WARM_WINDOW = getattr(settings, 'SB_WARM_WINDOW', 30)
+
+queue = CacheQueue('warm')
+
+
+def get_pending_cache_key(path):
+    return 'sb.warm.%s' % urllib.quote(path)
+
+def enqueue(paths):
+    for path in paths:
+        if cache.add(get_pending_cache_key(path), 1, WARM_WINDOW):
+            queue.put(path)
+        else:
+            stats.incr('warm.coalesced')
+
+def warm(limit=100):
+    '''
+    Renders up to limit queued paths and returns how many were rendered.
+    
+    '''
+    paths = queue.pop_many(limit)
+    if not paths:
+        return 0
+    
+    cache.delete_many([get_pending_cache_key(path) for path in paths])
+    client = Client()
+    for path in paths:
+        try:
+            response = client.get(path)
+        except Exception:
+            stats.incr('warm.failed')
+            continue
+        if response.status_code == 200:
+            stats.incr('warm.rendered')
+        else:
+            stats.incr('warm.failed')
+    stats.flush()
+    return len(paths)